@@ -1,5 +1,6 @@
 import pandas as pd
 import numpy as np
+from scipy.cluster.hierarchy import from_mlab_linkage
 
 
 def parse_order_df(order_raw: pd.DataFrame) -> list:
@@ -11,73 +12,99 @@ def parse_heights_df(heights_raw: pd.DataFrame) -> list:
     return heights_raw.iloc[:, 0].values.tolist()
 
 
-def merge_matrix_from_R_to_scipy_format(merge_matrix: list) -> list:
-    scipy_matrix = []
-    for row in merge_matrix:
-        new_node = []
-        for element in row:
-            if element < 0:
-                transformed_el = abs(element) - 1
-            else:
-                transformed_el = element + len(merge_matrix)
-            new_node.append(transformed_el)
-        scipy_matrix.append(new_node)
-    return scipy_matrix
-
-
-def parse_r_hclust(merge_raw: pd.DataFrame, parsed_heights, parsed_order) -> list:
-    first_col = merge_raw.iloc[:, 0].values.tolist()
-    second_col = merge_raw.iloc[:, 1].values.tolist()
-    merge_matrix_as_list = [
-        [float(x_1), float(x_2)] for x_1, x_2 in zip(first_col, second_col)
-    ]
+def merge_matrix_from_R_to_scipy_format(merge_matrix) -> np.ndarray:
+    """
+    R numbers the points -1..-n and the merges 1..n-1, scipy numbers the points
+    0..n-1 and the links n..2n-2.
+    """
+    merge_matrix = np.asarray(merge_matrix, dtype=np.int64)
+    return np.where(
+        merge_matrix < 0, -merge_matrix - 1, merge_matrix + len(merge_matrix)
+    )
 
-    merge_matrix = merge_matrix_from_R_to_scipy_format(merge_matrix_as_list)
 
-    for i in range(len(merge_matrix)):
-        merge_matrix[i].append(parsed_heights[i])
-        merge_matrix[i].append(parsed_order[i])
-    return merge_matrix
+def r_hclust_to_linkage(merge, heights) -> np.ndarray:
+    """
+    Converts the merge matrix and the joining heights of an R hclust object to
+    a scipy linkage matrix.
+    :param merge: (n-1) x 2 merge matrix of hclust
+    :param heights: n-1 joining heights of hclust
+    :return: float64 (n-1) x 4 array with the two joined nodes, the joining height
+        and the number of points in the new cluster
+    :raises ValueError: when a merge joins a point or merge that does not exist
+    """
+    merge = np.asarray(merge, dtype=np.int64)
+    nr_links = len(merge)
+    if nr_links == 0:
+        return np.empty((0, 4), dtype=np.float64)
+    # a merge only joins the merges before it
+    formed = np.arange(nr_links)[:, np.newaxis]
+    if ((merge == 0) | (merge < -(nr_links + 1)) | (merge > formed)).any():
+        raise ValueError("The merge matrix is not an hclust merge matrix")
+
+    # MATLAB numbers the points 1..n and the links n+1..2n-1, scipy converts that
+    # format and counts the cluster sizes in compiled code
+    mlab = np.empty((nr_links, 3), dtype=np.float64)
+    mlab[:, :2] = merge_matrix_from_R_to_scipy_format(merge) + 1
+    mlab[:, 2] = np.asarray(heights, dtype=np.float64)
+    return from_mlab_linkage(mlab)
+
+
+def parse_r_hclust(merge_raw: pd.DataFrame, parsed_heights, parsed_order=None):
+    """
+    Scipy linkage matrix of an R hclust object read into data frames.
+    parsed_order is not needed, the leaf order follows from the merges.
+    Since 0.1.0 the linkage is an (n-1) x 4 ndarray as returned by
+    r_hclust_to_linkage, before it was a list of rows whose fourth column held
+    parsed_order instead of the cluster sizes.
+    """
+    return r_hclust_to_linkage(
+        merge_raw.iloc[:, :2].to_numpy(dtype=np.int64), parsed_heights
+    )
 
 
-def iterate_linkage(linkage, start_index, nr_points, known_points):
+def leaf_intervals(linkage):
     """
-    Recursive functions which returns a tuple of point indices under a given split point or calls itself
-    Known points is a tuple of points which are already known to be under a given split point. those are appended to the new tuple
+    Computes the dendrogram leaf order and the [start, end) interval of leaf positions
+    covered by every node. Every subtree covers a contiguous block of the leaf order,
+    so the leaves under a node are simply leaf_order[start[node]:end[node]].
+    Nodes are numbered as in scipy: points are 0..n-1, linkage row i is node n + i.
+    The intervals are computed iteratively in O(n), so deep (chained) trees do not
+    hit the recursion limit.
     """
-    if start_index < nr_points:
-        return known_points + (int(start_index),)
+    children = np.asarray(linkage)[:, :2].astype(int).tolist()
+    nr_points = len(children) + 1
+
+    sizes = [1] * nr_points + [0] * len(children)
+    for row, (left, right) in enumerate(children):
+        sizes[nr_points + row] = sizes[left] + sizes[right]
 
-    else:
-        reversed_index = int(start_index - nr_points)
-        left = linkage[reversed_index][0]
-        right = linkage[reversed_index][1]
+    # the root is formed by the last row, left child is placed before the right one
+    start = [0] * len(sizes)
+    for row in range(len(children) - 1, -1, -1):
+        left, right = children[row]
+        start[left] = start[nr_points + row]
+        start[right] = start[nr_points + row] + sizes[left]
 
-        return iterate_linkage(
-            linkage, left, nr_points, known_points
-        ) + iterate_linkage(linkage, right, nr_points, known_points)
+    start = np.array(start, dtype=int)
+    end = start + np.array(sizes, dtype=int)
+    leaf_order = np.empty(nr_points, dtype=int)
+    leaf_order[start[:nr_points]] = np.arange(nr_points)
+    return leaf_order, start, end
 
 
 def split_dendrogram(
     link_mat: np.ndarray, split_points: list[int], cluster_ids: list[int]
 ):
-    next_cluster_index = 0
     nr_points = link_mat.shape[0] + 1
-    initial_cluster_assignments = [next_cluster_index] * nr_points
-    user_defined_cluster_indices = iter(cluster_ids)
-
-    # linkage matrix is sorted by distance
-    for point in split_points:
-        next_cluster_index = next(user_defined_cluster_indices)
-        reversed_index = int(nr_points - point - 1)
-        left = link_mat[reversed_index][0]
-        right = link_mat[reversed_index][1]
-
-        indices = iterate_linkage(link_mat, left, nr_points, tuple()) + iterate_linkage(
-            link_mat, right, nr_points, tuple()
-        )
+    leaf_order, start, end = leaf_intervals(link_mat)
+    ordered_assignments = np.zeros(nr_points, dtype=int)
 
-        for index in indices:
-            initial_cluster_assignments[index] = next_cluster_index
+    # linkage matrix is sorted by distance, node 1 is the last row
+    for point, cluster_id in zip(split_points, cluster_ids):
+        node = nr_points + int(nr_points - point - 1)
+        ordered_assignments[start[node] : end[node]] = cluster_id
 
-    return initial_cluster_assignments
+    cluster_assignments = np.empty(nr_points, dtype=int)
+    cluster_assignments[leaf_order] = ordered_assignments
+    return cluster_assignments.tolist()
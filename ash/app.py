@@ -1,34 +1,150 @@
 import copy
+import io
+import time
 from collections import Counter
-from unittest.mock import patch
 
-import matplotlib.pyplot
+import matplotlib
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
-from dash import (Dash, Input, Output, State, ctx, dash_table, dcc,
-                  get_asset_url, html)
+from dash import (ClientsideFunction, Dash, Input, Output, Patch, State, ctx,
+                  dash_table, dcc, get_asset_url, html, no_update)
+from dash.exceptions import PreventUpdate
 from plotly.subplots import make_subplots
+from scipy.cluster.hierarchy import is_valid_linkage
 
-from common.custom_data_utils import uploaded_content_to_df
-from common.custom_threshold_plotly_dendrogram import \
-    create_dendrogram_modified
-from common.data_parser import (RDataParser, parse_heights_df, parse_merge_df,
-                                parse_order_df)
+from common.cluster_state import cluster_state_for
+from common.clustering import (MAX_EXACT_ROWS, compute_linkage, micro_clusters,
+                               shard_clusters)
+from common.color_mappings import (COLORBLIND_PALETTE,
+                                   KELLY_MAX_CONTRAST_PALETTE)
+from common.custom_data_utils import read_upload, uploaded_content_to_bytes
+from common.custom_threshold_plotly_dendrogram import (
+    create_dendrogram_modified, link_colors, link_slots, touched_link_colors)
+from common.data_parser import parse_heights_df, parse_merge_df, parse_order_df
+from common.dataset_store import (DatasetNotFoundError, StoredDataset,
+                                  dataset_available, get_dataset, put_dataset)
+from common.default_data import default_data
+from common.dendrogram_view import (DendrogramView, dendrogram_x_range,
+                                    heatmap_bins)
+from common.jobs import JobQueueFullError, background_callback_manager
+from common.linkage_index import get_linkage_index
 from common.plot_master import PlotMaster
-from common.util import (assign_clusters, convert_to_dict,
-                         plot_input_data_reduced, write_to_text_file)
-from layout import (LOAD_MERGE_MATRIX_FROM_FILE_DIV,
-                    RECALCULATE_MERGE_MATRIX_DIV, create_layout)
+from common.precompute import RUNNING, artifact_readiness, precompute_artifacts
+from common.session_snapshots import (SessionSnapshot, list_snapshots,
+                                      read_snapshot, schedule_snapshot,
+                                      snapshot_label)
+from common.session_store import load_session, schedule_session_save
+from common.uploads import (UPLOAD_STALL_SECONDS, remove_upload, upload_path,
+                            upload_progress, uploads)
+from common.util import (assign_clusters, convert_to_dict, indexable_cycle,
+                         plot_input_data_reduced)
+from layout import (CLUSTERED_IN_APP_DIV, LOAD_MERGE_MATRIX_FROM_FILE_DIV,
+                    RECALCULATE_MERGE_MATRIX_DIV, SESSION_RESTORED_DIV,
+                    create_layout)
 
-matplotlib.pyplot.switch_backend("agg")
+matplotlib.use("agg")
 
-r = RDataParser()
-r.parse()
-
-app = Dash(__name__)
-feature_names = r.dataset.columns
-app.layout = create_layout(feature_names)
+app = Dash(__name__, background_callback_manager=background_callback_manager())
+# the feature options are filled in by load_custom_data, the default dataset is
+# only loaded when the first page asks for it
+app.layout = create_layout([])
 server = app.server
+server.register_blueprint(uploads)
+
+
+def selected_palette(colorblind_palette_input):
+    if colorblind_palette_input == "Colorblind palette on":
+        return COLORBLIND_PALETTE
+    return KELLY_MAX_CONTRAST_PALETTE
+
+
+def put_default_dataset() -> dict:
+    default = default_data()
+    return put_dataset(
+        default.dataset, default.merge_matrix, default.labels, default.order
+    )
+
+
+def stored_dataset(dataset_handle) -> StoredDataset:
+    """
+    Dataset behind the handle kept in merge-matrix-memory.
+    """
+    try:
+        return get_dataset(dataset_handle)
+    except DatasetNotFoundError:
+        if dataset_handle and dataset_handle["key"] == put_default_dataset()["key"]:
+            return get_dataset(dataset_handle)
+        # evicted upload or a handle from a restarted server, show_expired_dataset
+        # asks to upload the data again
+        raise PreventUpdate
+
+
+def session_dataset(session_id) -> dict | None:
+    """
+    Handle of the dataset the browser session was last working on, None when the
+    session is unknown or its dataset was evicted.
+    """
+    session = load_session(session_id) if session_id else None
+    if session is None:
+        return None
+    try:
+        get_dataset(session["dataset"])
+    except DatasetNotFoundError:
+        return None
+    return session["dataset"]
+
+
+def cluster_dataset(
+    dataset: pd.DataFrame, linkage_method, distance_metric, clustering_mode="Exact"
+) -> dict:
+    """
+    Clusters the rows of the dataset in-process and stores it with its linkage.
+    The approximate mode clusters micro-cluster centroids instead of the rows, the
+    sharded mode the subtrees of shards clustered in parallel.
+    :return: handle of the stored dataset
+    """
+    points, members = None, None
+    if clustering_mode in ("Approximate", "Sharded"):
+        if clustering_mode == "Approximate":
+            centroids, members = micro_clusters(dataset.to_numpy(dtype=float))
+        else:
+            centroids, members = shard_clusters(
+                dataset.to_numpy(dtype=float), linkage_method, distance_metric
+            )
+        points, dataset = dataset, pd.DataFrame(centroids, columns=dataset.columns)
+    elif len(dataset) > MAX_EXACT_ROWS:
+        raise ValueError(
+            f"Exact clustering is limited to {MAX_EXACT_ROWS} rows, "
+            "use the approximate mode"
+        )
+    merge_matrix = compute_linkage(
+        dataset.to_numpy(dtype=float), linkage_method, distance_metric
+    )
+    return store_linkage(dataset, merge_matrix, points, members)
+
+
+def store_linkage(
+    dataset: pd.DataFrame, merge_matrix, points=None, members=None
+) -> dict:
+    """
+    Stores the dataset with a scipy linkage matrix of its rows, the leaves are
+    ordered as scipy draws them.
+    :return: handle of the stored dataset
+    """
+    merge_matrix = np.asarray(merge_matrix, dtype=np.float64)
+    if len(merge_matrix) != len(dataset) - 1:
+        raise ValueError("The linkage matrix does not match the rows of the data")
+    is_valid_linkage(merge_matrix, throw=True, name="linkage")
+    leaf_order = get_linkage_index(merge_matrix).leaf_order
+    return put_dataset(
+        dataset,
+        merge_matrix,
+        [i for i in range(len(dataset))],
+        leaf_order.astype(float).tolist(),
+        points,
+        members,
+    )
 
 
 # reset dropdown-heatmap-plot when new data are uploaded
@@ -62,6 +178,73 @@ def reset_dim_red_algo(_):
     return None
 
 
+app.clientside_callback(
+    ClientsideFunction(namespace="session", function_name="ensure_id"),
+    Output("session-id", "data"),
+    Input("session-id", "modified_timestamp"),
+    State("session-id", "data"),
+)
+
+
+app.clientside_callback(
+    ClientsideFunction(namespace="upload", function_name="start_upload"),
+    Output("chunked-upload", "data"),
+    Input("chunked-upload-button", "n_clicks"),
+    prevent_initial_call=True,
+)
+
+
+@app.callback(
+    Output("chunked-upload-progress", "children"),
+    Output("chunked-upload-interval", "disabled"),
+    Output("chunked-upload-complete", "data"),
+    Output("chunked-upload-activity", "data"),
+    Input("chunked-upload-interval", "n_intervals"),
+    Input("chunked-upload", "data"),
+    State("chunked-upload-activity", "data"),
+    prevent_initial_call=True,
+)
+def poll_chunked_upload(_, upload, activity):
+    """
+    Shows the progress of the files streamed to the /upload route and hands the
+    upload over to load_custom_data once all files are on the server. Polling
+    stops for rejected files and for uploads without progress for
+    UPLOAD_STALL_SECONDS.
+    """
+    if not upload:
+        raise PreventUpdate
+    if "error" in upload:
+        # files rejected in the browser, see chunked_upload.js
+        return upload["error"], True, no_update, None
+    try:
+        received, total, complete = upload_progress(upload["id"], upload["files"])
+    except ValueError as error:
+        return str(error), True, no_update, None
+    if complete:
+        return "Upload finished", True, upload, None
+
+    now = time.time()
+    if (
+        ctx.triggered_id == "chunked-upload"
+        or activity is None
+        or received > activity["received"]
+    ):
+        activity = {"received": received, "at": now}
+    elif now - activity["at"] > UPLOAD_STALL_SECONDS:
+        return (
+            "Upload stopped, upload the same files again to resume",
+            True,
+            no_update,
+            None,
+        )
+    return (
+        f"Uploading {received / 2**20:.1f} of {total / 2**20:.1f} MB",
+        False,
+        no_update,
+        activity,
+    )
+
+
 @app.callback(
     Output("merge-matrix-memory", "data"),
     Output("output-data-upload", "children"),
@@ -69,50 +252,289 @@ def reset_dim_red_algo(_):
     Output("dropdown-selected-features-plot-1", "options"),
     Output("dropdown-selected-features-plot-2", "options"),
     Input("upload-data", "contents"),
+    Input("chunked-upload-complete", "data"),
     State("upload-data", "filename"),
+    State("linkage-method-dropdown", "value"),
+    State("distance-metric-dropdown", "value"),
+    State("clustering-mode-dropdown", "value"),
+    State("session-id", "data"),
 )
-def load_custom_data(contents, list_of_names):
-
-    default_data = {
-        "merge_matrix": r.merge_matrix,
-        "dataset": r.dataset.to_json(date_format="iso", orient="split"),
-        "labels": r.labels,
-        "order": r.order,
-    }
-
-    if [contents, list_of_names] == [None, None]:
+def load_custom_data(
+    contents,
+    chunked_upload,
+    list_of_names,
+    linkage_method,
+    distance_metric,
+    clustering_mode,
+    session_id,
+):
+    if contents is None and ctx.triggered_id != "chunked-upload-complete":
+        # a returning browser continues where it left off
+        restored = session_dataset(session_id)
+        if restored is not None:
+            feature_names = get_dataset(restored).dataset.columns
+            return (
+                restored,
+                SESSION_RESTORED_DIV,
+                feature_names,
+                feature_names,
+                feature_names,
+            )
+        default_dataset = put_default_dataset()
+        precompute_artifacts(get_dataset(default_dataset))
+        feature_names = default_data().dataset.columns
         return (
-            default_data,
+            default_dataset,
             LOAD_MERGE_MATRIX_FROM_FILE_DIV,
-            r.dataset.columns,
-            r.dataset.columns,
-            r.dataset.columns,
+            feature_names,
+            feature_names,
+            feature_names,
         )
 
-    files = {}
-    for content, name in zip(contents, list_of_names):
-        files[name] = uploaded_content_to_df(content)
+    try:
+        if ctx.triggered_id == "chunked-upload-complete":
+            # the files are already on the server, only their location was sent
+            uploaded_files = [
+                (upload_path(chunked_upload["id"], file["name"]), file["name"])
+                for file in chunked_upload["files"]
+            ]
+        else:
+            uploaded_files = [
+                (io.BytesIO(uploaded_content_to_bytes(content)), name)
+                for content, name in zip(contents, list_of_names)
+            ]
+        files = {}
+        for source, name in uploaded_files:
+            files.update(read_upload(source, name))
+        dataset = files["data"]
 
-    parsed_heights = parse_heights_df(files["heights.csv"])
-    parsed_order = parse_order_df(files["order.csv"])
-    custom_data = {
-        "merge_matrix": parse_merge_df(
-            files["merge.csv"], parsed_heights, parsed_order
-        ),
-        "dataset": files["data.csv"].to_json(date_format="iso", orient="split"),
-        "labels": [i for i in range(len(parsed_order))],
-        "order": parsed_order,
-    }
+        # the dataset stays on the server, the browser only gets its handle
+        if "linkage" in files:
+            custom_data = store_linkage(dataset, files["linkage"])
+            upload_message = RECALCULATE_MERGE_MATRIX_DIV
+        elif "merge" in files:
+            parsed_heights = parse_heights_df(files["heights"])
+            parsed_order = parse_order_df(files["order"])
+            custom_data = put_dataset(
+                dataset,
+                parse_merge_df(files["merge"], parsed_heights),
+                [i for i in range(len(parsed_order))],
+                parsed_order,
+            )
+            upload_message = RECALCULATE_MERGE_MATRIX_DIV
+        else:
+            # no clustering computed elsewhere, cluster the data here
+            custom_data = cluster_dataset(
+                dataset, linkage_method, distance_metric, clustering_mode
+            )
+            upload_message = CLUSTERED_IN_APP_DIV
+    except (KeyError, ValueError) as error:
+        return no_update, html.Div(str(error)), no_update, no_update, no_update
+    finally:
+        if ctx.triggered_id == "chunked-upload-complete":
+            remove_upload(chunked_upload["id"])
+    # build the artifacts needed by the first plots while the page updates
+    precompute_artifacts(get_dataset(custom_data))
 
     return (
         custom_data,
-        RECALCULATE_MERGE_MATRIX_DIV,
-        files["data.csv"].columns,
-        files["data.csv"].columns,
-        files["data.csv"].columns,
+        upload_message,
+        dataset.columns,
+        dataset.columns,
+        dataset.columns,
+    )
+
+
+@app.callback(
+    Output("merge-matrix-memory", "data", allow_duplicate=True),
+    Output("recalculate-message", "children"),
+    Input("recalculate-button", "n_clicks"),
+    State("merge-matrix-memory", "data"),
+    State("linkage-method-dropdown", "value"),
+    State("distance-metric-dropdown", "value"),
+    State("clustering-mode-dropdown", "value"),
+    prevent_initial_call=True,
+)
+def recalculate_clustering(
+    _, dataset_handle, linkage_method, distance_metric, clustering_mode
+):
+    """
+    Replaces the clustering of the current dataset by one computed in-process.
+    """
+    uploaded = stored_dataset(dataset_handle)
+    try:
+        clustered = cluster_dataset(
+            uploaded.observations, linkage_method, distance_metric, clustering_mode
+        )
+    except ValueError as error:
+        return no_update, str(error)
+    precompute_artifacts(get_dataset(clustered))
+    return (
+        clustered,
+        f"Clustered by {linkage_method} linkage of {distance_metric} distances",
+    )
+
+
+@app.callback(
+    Output("merge-matrix-memory", "data", allow_duplicate=True),
+    Output("expand-message", "children"),
+    Input("expand-button", "n_clicks"),
+    Input("overview-button", "n_clicks"),
+    State("merge-matrix-memory", "data"),
+    State("split_point", "value"),
+    State("linkage-method-dropdown", "value"),
+    State("distance-metric-dropdown", "value"),
+    prevent_initial_call=True,
+)
+def expand_node(
+    expand_clicks,
+    overview_clicks,
+    dataset_handle,
+    node_number,
+    linkage_method,
+    distance_metric,
+):
+    """
+    Drills down from an approximate dendrogram into the exact dendrogram of the
+    observations under a node, and back.
+    """
+    uploaded = stored_dataset(dataset_handle)
+    if ctx.triggered_id == "overview-button":
+        if not dataset_handle.get("parent"):
+            return no_update, "The dendrogram is not expanded from an overview"
+        return dataset_handle["parent"], None
+
+    if not uploaded.approximate:
+        return no_update, "Only approximate and sharded dendrograms can be expanded"
+    index = uploaded.linkage_index
+    if node_number is None or not 1 <= node_number <= index.nr_links:
+        return no_update, "Select a node of the dendrogram to expand"
+    in_node = np.isin(uploaded.members, index.leaves(int(node_number)))
+    try:
+        if np.count_nonzero(in_node) > MAX_EXACT_ROWS:
+            raise ValueError(
+                f"Node {node_number} holds more than {MAX_EXACT_ROWS} observations"
+            )
+        expanded = cluster_dataset(
+            uploaded.points.loc[in_node].reset_index(drop=True),
+            linkage_method,
+            distance_metric,
+        )
+    except ValueError as error:
+        return no_update, str(error)
+    precompute_artifacts(get_dataset(expanded))
+    # the way back is kept in the browser, any server process can follow it
+    return dict(expanded, parent=dataset_handle), f"Node {node_number} expanded"
+
+
+@app.callback(
+    Output("snapshot-dropdown", "options"),
+    Output("snapshot-dropdown", "value"),
+    Output("snapshot-message", "children", allow_duplicate=True),
+    Input("session-id", "data"),
+    Input("save-snapshot-button", "n_clicks"),
+    State("merge-matrix-memory", "data"),
+    State("monocrit-list", "data"),
+    State("cluster-indices", "data"),
+    State("colorblind-palette-dropdown", "value"),
+    prevent_initial_call=True,
+)
+def save_snapshot(session_id, _, dataset_handle, monocrit_list, cluster_ids, palette):
+    """
+    Adds the split points, cluster ids and palette shown now to the snapshots of
+    the session and lists the snapshots to restore.
+    """
+    if not session_id:
+        raise PreventUpdate
+    message = no_update
+    if ctx.triggered_id == "save-snapshot-button":
+        uploaded = stored_dataset(dataset_handle)
+        # written in the background, the list already holds it
+        schedule_snapshot(
+            session_id,
+            SessionSnapshot(
+                uploaded.key,
+                uploaded.linkage_index.key,
+                monocrit_list or [],
+                cluster_ids or [],
+                palette,
+            ),
+        )
+        message = "Snapshot saved"
+    names = list_snapshots(session_id)
+    options = [{"label": snapshot_label(name), "value": name} for name in names]
+    return options, names[0] if names else None, message
+
+
+@app.callback(
+    Output("merge-matrix-memory", "data", allow_duplicate=True),
+    Output("restored-snapshot", "data"),
+    Output("colorblind-palette-dropdown", "value"),
+    Output("snapshot-message", "children"),
+    Input("restore-snapshot-button", "n_clicks"),
+    State("session-id", "data"),
+    State("snapshot-dropdown", "value"),
+    State("merge-matrix-memory", "data"),
+    prevent_initial_call=True,
+)
+def restore_snapshot(_, session_id, name, dataset_handle):
+    """
+    Brings back the dataset, split points and palette of the selected snapshot of
+    the session. The split points are handed to add_split_point through the
+    restored-snapshot store.
+    """
+    snapshot = read_snapshot(session_id, name) if session_id and name else None
+    if snapshot is None:
+        return no_update, no_update, no_update, "Select a saved snapshot"
+    try:
+        restored = get_dataset({"key": snapshot.dataset_key})
+    except DatasetNotFoundError:
+        return no_update, no_update, no_update, "The data of the snapshot were removed"
+    if restored.linkage_index.key != snapshot.linkage_key:
+        return no_update, no_update, no_update, "The snapshot does not match its data"
+    return (
+        restored.handle if restored.handle != dataset_handle else no_update,
+        {"monocrit_list": snapshot.split_points, "cluster_ids": snapshot.cluster_ids},
+        snapshot.palette or no_update,
+        "Snapshot restored",
     )
 
 
+@app.callback(
+    Output("dataset-expired", "children"),
+    Input("dataset-check-interval", "n_intervals"),
+    Input("merge-matrix-memory", "data"),
+)
+def show_expired_dataset(_, dataset_handle):
+    """
+    Tells the user when the dataset of the page was removed from the server, the
+    callbacks needing it do not update anymore.
+    """
+    if not dataset_handle or dataset_available(dataset_handle):
+        return None
+    if dataset_handle["key"] == put_default_dataset()["key"]:
+        return None
+    return "The dataset has expired on the server, please upload it again."
+
+
+@app.callback(
+    Output("artifact-readiness", "children"),
+    Output("artifact-readiness-interval", "disabled"),
+    Input("artifact-readiness-interval", "n_intervals"),
+    Input("merge-matrix-memory", "data"),
+)
+def show_artifact_readiness(_, dataset_handle):
+    """
+    Polls the artifacts precomputed after an upload until all of them are done.
+    """
+    readiness = artifact_readiness(stored_dataset(dataset_handle))
+    if not readiness and ctx.triggered_id == "artifact-readiness-interval":
+        # answered by a server process that did not start the precompute
+        return no_update, no_update
+    children = [html.Div(f"{name}: {state}") for name, state in readiness.items()]
+    return children, RUNNING not in readiness.values()
+
+
 @app.callback(
     [
         Output("monocrit-list", "data"),
@@ -126,9 +548,11 @@ def load_custom_data(contents, list_of_names):
         Input("reset-button", "n_clicks"),
         Input("dendrogram-click-memory", "data"),
         Input("merge-matrix-memory", "data"),
+        Input("restored-snapshot", "data"),
         State("cluster-indices", "data"),
         State("cluster-id", "value"),
         State("split_point", "value"),
+        State("session-id", "data"),
     ],
 )
 def add_split_point(
@@ -137,17 +561,28 @@ def add_split_point(
     unsplit_button_clicks,
     reset_button_clicks,
     dendrogram_click_data,
-    merge_matrix_json,
+    dataset_handle,
+    restored_snapshot,
     cluster_indices,
     cluster_id,
     split_point_value,
+    session_id,
 ):
     if not monocrit_split_points:
         monocrit_split_points = []
         cluster_indices = []
-    if ctx.triggered_id == "merge-matrix-memory":
-        # reset when new data are uploaded
-        return [], [], 1
+    if "restored-snapshot.data" in ctx.triggered_prop_ids:
+        # also set when the snapshot brought back other data
+        monocrit_split_points = restored_snapshot["monocrit_list"]
+        cluster_indices = restored_snapshot["cluster_ids"]
+    elif ctx.triggered_id == "merge-matrix-memory":
+        # reset when new data are uploaded, a restored session keeps its split points
+        session = load_session(session_id) if session_id else None
+        if session is not None and session["dataset"] == dataset_handle:
+            monocrit_split_points = session["monocrit_list"]
+            cluster_indices = session["cluster_ids"]
+        else:
+            monocrit_split_points, cluster_indices = [], []
     elif ctx.triggered_id == "split-button":
         # add cluster index to monocrit list
         monocrit_split_points.append(int(split_point_value))
@@ -169,58 +604,94 @@ def add_split_point(
 
     elif ctx.triggered_id == "dendrogram-click-memory":
         if dendrogram_click_data is not None:
-            label = dendrogram_click_data["points"][0]["hovertext"]
-            _, node_nr = label.split(" ")
+            point = dendrogram_click_data["points"][0]
+            node_nr = point.get("customdata")
+            if node_nr is None and "hovertext" in point:
+                _, node_nr = point["hovertext"].split(" ")
 
-            monocrit_split_points.append(int(node_nr))
-            cluster_indices.append(int(cluster_id))
+            # clicks on the heatmap carry no node
+            if node_nr is not None:
+                monocrit_split_points.append(int(node_nr))
+                cluster_indices.append(int(cluster_id))
     try:
         next_cluster_label = max(cluster_indices) + 1
     except:
         next_cluster_label = 1
+    if session_id and dataset_handle:
+        schedule_session_save(
+            session_id,
+            {
+                "dataset": dataset_handle,
+                "monocrit_list": monocrit_split_points,
+                "cluster_ids": cluster_indices,
+            },
+        )
     return monocrit_split_points, cluster_indices, next_cluster_label
 
 
 @app.callback(
     Output("dendrogram-custom", "figure"),
+    Output("dendrogram-x-range", "data"),
     [
         Input("merge-matrix-memory", "data"),
         Input(
             "dendrogram-memory", "data"
         ),
         Input("dropdown-heatmap-plot", "value"),
+        Input("heatmap-aggregation-dropdown", "value"),
         Input("colorblind-palette-dropdown", "value"),
     ],
+    State("monocrit-list", "data"),
+    State("cluster-indices", "data"),
+    State("dendrogram-x-range", "data"),
 )
 def plot_dendrogram(
-    merge_matrix_json, data, heatmap_features, colorblind_palette_input
+    dataset_handle,
+    data,
+    heatmap_features,
+    heatmap_aggregation,
+    colorblind_palette_input,
+    monocrit_list,
+    cluster_ids,
+    x_range,
 ):
-    fig = make_subplots(rows=2, cols=1, vertical_spacing=0)
-    dendrogram = go.Figure(data=data["data"], layout=data["layout"])
+    palette = selected_palette(colorblind_palette_input)
+    monocrit_list = monocrit_list or []
+    uploaded = stored_dataset(dataset_handle)
+    index = uploaded.linkage_index
+    state, _ = cluster_state_for(index, monocrit_list, cluster_ids or [])
+    colors = link_colors(state, palette)
+
+    if set(ctx.triggered_prop_ids) == {"dendrogram-memory.data"} and data.get("delta"):
+        # split or unsplit, redraw the visible links of the colors that changed
+        view = DendrogramView(index, x_range)
+        slots = link_slots(palette)
+        fig = Patch()
+        for slot, trace in enumerate(view.traces(colors, monocrit_list, palette)):
+            if slot == len(slots) or slots[slot] in data["delta"]:
+                fig["data"][slot] = dict(trace, xaxis="x", yaxis="y")
+        return fig, no_update
 
-    for trace in dendrogram.data:
+    fig = make_subplots(rows=2, cols=1, vertical_spacing=0)
+    view = DendrogramView(index)
+    for trace in view.traces(colors, monocrit_list, palette):
         fig.add_trace(trace, row=1, col=1)
     fig.update_layout(data["layout"])
 
-    # get the minimum and maximum x axis values across all traces
-    x_min = min([min(trace["x"]) for trace in dendrogram.data])
-    x_max = max([max(trace["x"]) for trace in dendrogram.data])
-    y_min = min([min(trace["y"]) for trace in dendrogram.data])
-    y_max = max([max(trace["y"]) for trace in dendrogram.data])
-
-    fig.update_layout(xaxis_range=[x_min, x_max])
-    fig.update_layout(yaxis_range=[y_min, y_max * 1.1])
+    icoord, dcoord = index.link_coordinates()
+    # the heatmap columns lie under the leaves, zooming into either plot zooms both
+    fig.update_layout(xaxis_range=[0, 10 * index.nr_points], xaxis2_matches="x")
+    fig.update_layout(yaxis_range=[dcoord.min(), dcoord.max() * 1.1])
 
     plot_master = PlotMaster(
-        pd.read_json(merge_matrix_json["dataset"], orient="split"),
+        uploaded.dataset,
         data["labels"],
-        merge_matrix_json["order"],
+        uploaded.order,
         data["leaves_color_map_translated"],
+        linkage_index=index,
+        artifacts=uploaded,
     )
-    dataset = pd.read_json(merge_matrix_json["dataset"], orient="split")
-    dataset["dendrogram_order"] = merge_matrix_json["order"]
-    dataset = dataset.sort_values(by="dendrogram_order")
-    dataset = dataset.drop(columns=["dendrogram_order"])
+    dataset = plot_master.ordered_input_data()
 
     try:
         colorblind_palette = (
@@ -230,21 +701,80 @@ def plot_dendrogram(
             colorscale = "GnBu"
         else:
             colorscale = None
+        heatmap_input = plot_master.df_to_plotly(dataset, heatmap_features)
+        # consecutive leaves are binned into one column per pixel
+        x, z = heatmap_bins(heatmap_input["z"], aggregation=heatmap_aggregation)
         heatmap = go.Figure(
             data=go.Heatmap(
-                plot_master.df_to_plotly(dataset, heatmap_features),
+                dict(heatmap_input, x=x, z=z),
                 colorbar={"title": "Feature Value"},
                 colorscale=colorscale,
             )
         )
-    except KeyError:
+    except (KeyError, ValueError):
         heatmap = go.Figure()
 
     for trace in heatmap.data:
         fig.add_trace(trace, row=2, col=1)
     fig.update_layout(data["layout"])
 
-    return fig
+    # the rebuilt figure shows the whole dendrogram
+    return fig, None
+
+
+@app.callback(
+    Output("dendrogram-custom", "figure", allow_duplicate=True),
+    Output("dendrogram-x-range", "data", allow_duplicate=True),
+    Input("dendrogram-custom", "relayoutData"),
+    State("merge-matrix-memory", "data"),
+    State("monocrit-list", "data"),
+    State("cluster-indices", "data"),
+    State("colorblind-palette-dropdown", "value"),
+    State("dropdown-heatmap-plot", "value"),
+    State("heatmap-aggregation-dropdown", "value"),
+    prevent_initial_call=True,
+)
+def zoom_dendrogram(
+    relayout_data,
+    dataset_handle,
+    monocrit_list,
+    cluster_ids,
+    colorblind_palette_input,
+    heatmap_features,
+    heatmap_aggregation,
+):
+    """
+    Redraws the dendrogram links within the zoomed range, subtrees too narrow
+    to be seen are collapsed into stubs and expanded when zoomed into. The
+    heatmap is binned again for the leaves within the range.
+    """
+    if not relayout_data or not any(
+        key.startswith(("xaxis.", "xaxis2.")) for key in relayout_data
+    ):
+        return no_update, no_update
+
+    palette = selected_palette(colorblind_palette_input)
+    monocrit_list = monocrit_list or []
+    uploaded = stored_dataset(dataset_handle)
+    index = uploaded.linkage_index
+    state, _ = cluster_state_for(index, monocrit_list, cluster_ids or [])
+    x_range = dendrogram_x_range(relayout_data)
+    view = DendrogramView(index, x_range)
+
+    fig = Patch()
+    traces = view.traces(link_colors(state, palette), monocrit_list, palette)
+    for slot, trace in enumerate(traces):
+        fig["data"][slot] = dict(trace, xaxis="x", yaxis="y")
+
+    try:
+        heatmap_values = uploaded.ordered_dataset[heatmap_features].T.values
+        x, z = heatmap_bins(heatmap_values, x_range, heatmap_aggregation)
+    except (KeyError, ValueError):
+        # no heatmap is drawn
+        return fig, x_range
+    fig["data"][len(traces)]["x"] = x
+    fig["data"][len(traces)]["z"] = z
+    return fig, x_range
 
 
 @app.callback(
@@ -262,9 +792,10 @@ def store_dendrogram_click(clickData):
     Input(
         "merge-matrix-memory", "data"
     ),  # triggered when new data are uploaded i.e. merge matrix is recalculated
+    State("dendrogram-memory", "data"),
 )
 def create_dendrogram(
-    colorblind_palette_input, monocrit_list, cluster_ids, merge_matrix_json
+    colorblind_palette_input, monocrit_list, cluster_ids, dataset_handle, shown
 ):
     """
     Dendrogram initialization
@@ -272,36 +803,65 @@ def create_dendrogram(
     colorblind_palette = (
         True if colorblind_palette_input == "Colorblind palette on" else False
     )
-    with patch(
-        "plotly.figure_factory._dendrogram._Dendrogram.get_dendrogram_traces",
-        new=create_dendrogram_modified,
-    ) as create_dendrogram:
-        custom_dendrogram = create_dendrogram(
-            merge_matrix_json["merge_matrix"],
-            labels=merge_matrix_json["labels"],
-            colorblind_palette=colorblind_palette,
-            monocrit_list=monocrit_list,
-            cluster_ids=cluster_ids,
-        )
-        assigned_clusters = convert_to_dict(
-            assign_clusters(custom_dendrogram.leaves_color_map_translated)
-        )
-        write_to_text_file("custom_dendrogram.txt", custom_dendrogram.dendro)
-
-        return {
-            "dendro": custom_dendrogram.dendro,
-            "leaves_color_map_translated": custom_dendrogram.leaves_color_map_translated,
-            "clusters": custom_dendrogram.clusters,
-            "labels": custom_dendrogram.labels,
-            "data": custom_dendrogram.data,
-            "layout": custom_dendrogram.layout,
-            "icoord": custom_dendrogram.xvals,
-            "dcoord": custom_dendrogram.yvals,
-            "assigned_clusters": assigned_clusters,
-            "monocrit_list": monocrit_list,
-            "cluster_indices": custom_dendrogram.cluster_indices,
-            "color_map": custom_dendrogram.color_map,
+    palette = selected_palette(colorblind_palette_input)
+    monocrit_list = monocrit_list or []
+    cluster_ids = cluster_ids or []
+
+    uploaded = stored_dataset(dataset_handle)
+    index = uploaded.linkage_index
+    triggered = set(ctx.triggered_prop_ids)
+    previous = None
+    if (
+        shown
+        and shown.get("linkage_key") == index.key
+        and triggered
+        and triggered <= {"monocrit-list.data", "cluster-indices.data"}
+    ):
+        # split or unsplit of the dendrogram this browser shows
+        previous = shown["monocrit_list"], shown["cluster_ids"]
+    state, change = cluster_state_for(index, monocrit_list, cluster_ids, previous)
+    if change is not None:
+        # split or unsplit, update only the links under the touched node, the
+        # clusters of the points are sent as one list, one patch operation per
+        # changed point would be larger than the list itself
+        dendrogram_update = Patch()
+        dendrogram_update["cluster_indices"] = state.cluster_indices.tolist()
+
+        dendrogram_update["clusters"] = len(state.clusters)
+        dendrogram_update["color_map"] = {
+            cluster: indexable_cycle(palette, cluster) for cluster in state.clusters
         }
+        dendrogram_update["monocrit_list"] = monocrit_list
+        dendrogram_update["cluster_ids"] = cluster_ids
+        dendrogram_update["delta"] = touched_link_colors(state, change, palette)
+        return dendrogram_update
+
+    custom_dendrogram = create_dendrogram_modified(
+        uploaded.merge_matrix,
+        labels=uploaded.labels,
+        colorblind_palette=colorblind_palette,
+        monocrit_list=monocrit_list,
+        cluster_ids=cluster_ids,
+    )
+    assigned_clusters = convert_to_dict(
+        assign_clusters(custom_dendrogram.leaves_color_map_translated)
+    )
+
+    # the figure is drawn from the cached linkage index, per-link geometry
+    # is not sent to the browser
+    return {
+        "leaves_color_map_translated": custom_dendrogram.leaves_color_map_translated,
+        "clusters": custom_dendrogram.clusters,
+        "labels": custom_dendrogram.labels,
+        "layout": custom_dendrogram.layout,
+        "assigned_clusters": assigned_clusters,
+        "monocrit_list": monocrit_list,
+        "cluster_ids": cluster_ids,
+        "linkage_key": index.key,
+        "cluster_indices": custom_dendrogram.cluster_indices,
+        "color_map": custom_dendrogram.color_map,
+        "delta": None,
+    }
 
 
 @app.callback(
@@ -314,9 +874,15 @@ def get_number_of_clusters(data):
 @app.callback(
     Output(component_id="cluster-stats-table", component_property="children"),
     [Input("dendrogram-memory", "data")],
+    State("merge-matrix-memory", "data"),
 )
-def update_cluster_stats_table(data):
-    counts_per_cluster = Counter(data["cluster_indices"])
+def update_cluster_stats_table(data, dataset_handle):
+    # micro-clusters count with all of their members
+    counts_per_cluster = Counter(
+        stored_dataset(dataset_handle)
+        .observation_clusters(data["cluster_indices"])
+        .tolist()
+    )
     cluster_indices_labels = list(set(data["cluster_indices"]))
     table_data = [
         {
@@ -360,22 +926,21 @@ def plot_heatmap(
     selected_rows: list[int],
     table_data,
     colorblind_palette_input,
-    merge_matrix_json,
+    dataset_handle,
 ):
+    uploaded = stored_dataset(dataset_handle)
     plot_master = PlotMaster(
-        pd.read_json(merge_matrix_json["dataset"], orient="split"),
+        uploaded.dataset,
         data["labels"],
-        merge_matrix_json["order"],
+        uploaded.order,
         data["leaves_color_map_translated"],
+        linkage_index=uploaded.linkage_index,
+        artifacts=uploaded,
     )
     try:
         selected_cluster_label = table_data[selected_rows[0]]["Cluster ID"]
         mask = [i == selected_cluster_label for i in data["cluster_indices"]]
-        data_subset = (
-            pd.read_json(merge_matrix_json["dataset"], orient="split")
-            .loc[mask, :]
-            .reset_index(drop=True)
-        )
+        data_subset = uploaded.dataset.loc[mask, :].reset_index(drop=True)
 
         colorblind_palette = (
             True if colorblind_palette_input == "Colorblind palette on" else False
@@ -419,10 +984,20 @@ def plot_heatmap(
     Input("merge-matrix-memory", "data"),
     prevent_initial_call=True,
 )
-def plot_two_selected_features(f1, f2, data, merge_matrix_json):
+def plot_two_selected_features(f1, f2, data, dataset_handle):
+    uploaded = stored_dataset(dataset_handle)
     try:
         color_mask = [data["color_map"][str(i)] for i in data["cluster_indices"]]
         features = [f1, f2]
+        if (
+            set(ctx.triggered_prop_ids) == {"dendrogram-memory.data"}
+            and None not in features
+            and f1 != f2
+        ):
+            # clusters changed, the points stay where they are
+            feature_plot = Patch()
+            feature_plot["data"][0]["marker"]["color"] = color_mask
+            return feature_plot, no_update
         if f1 == f2 and f1 is not None and f2 is not None:
             feature_plot = go.Figure()
             error_message = html.Div(
@@ -440,10 +1015,12 @@ def plot_two_selected_features(f1, f2, data, merge_matrix_json):
         else:
             color_map = copy.deepcopy(data["leaves_color_map_translated"])
             plot_master = PlotMaster(
-                pd.read_json(merge_matrix_json["dataset"], orient="split"),
-                merge_matrix_json["labels"],
-                merge_matrix_json["order"],
+                uploaded.dataset,
+                uploaded.labels,
+                uploaded.order,
                 color_map,
+                linkage_index=uploaded.linkage_index,
+                artifacts=uploaded,
             )
             feature_plot = plot_master.plot_selected_features(features, color_mask)
             feature_plot.update_layout({"xaxis_title": f1, "yaxis_title": f2})
@@ -468,13 +1045,30 @@ def plot_two_selected_features(f1, f2, data, merge_matrix_json):
 @app.callback(
     Output("reduced-graph", "figure"),
     Output("error-message-dim-red", "children"),
+    Output("reduced-graph-drawn", "data"),
     Input("plot_dropdown", "value"),
-    Input("dendrogram-memory", "data"),
     Input("ClusterRadio", "value"),
     Input("merge-matrix-memory", "data"),
+    State("dendrogram-memory", "data"),
+    # the reductions may take minutes, they run in a separate process so that
+    # the server keeps answering the other callbacks
+    background=True,
+    progress=Output("progress-dim-red", "children"),
+    running=[
+        (
+            Output("cancel-dim-red-button", "style"),
+            {"display": "inline-block"},
+            {"display": "none"},
+        ),
+    ],
+    cancel=[
+        Input("cancel-dim-red-button", "n_clicks"),
+        Input("upload-data", "contents"),
+        Input("chunked-upload-complete", "data"),
+    ],
 )
-def plot_data_reduced(value, data, highlight_area, merge_matrix_json):
-    if value is None:
+def plot_data_reduced(set_progress, value, highlight_area, dataset_handle, data):
+    if value is None or data is None:
         reduced_plot = go.Figure()
         error_message = (
             "Please select dimensionality reduction.\n "
@@ -484,18 +1078,47 @@ def plot_data_reduced(value, data, highlight_area, merge_matrix_json):
             "which may result in longer processing time."
         )
     else:
-        color_map = copy.deepcopy(data["leaves_color_map_translated"])
         color_mask = [data["color_map"][str(i)] for i in data["cluster_indices"]]
+        color_map = copy.deepcopy(data["leaves_color_map_translated"])
+        uploaded = stored_dataset(dataset_handle)
         plot_master = PlotMaster(
-            pd.read_json(merge_matrix_json["dataset"], orient="split"),
-            merge_matrix_json["labels"],
-            merge_matrix_json["order"],
+            uploaded.dataset,
+            uploaded.labels,
+            uploaded.order,
             color_map,
+            linkage_index=uploaded.linkage_index,
+            artifacts=uploaded,
+            progress=set_progress,
         )
-        reduced_plot = plot_input_data_reduced(value, plot_master, color_mask)
-        error_message = None
+        try:
+            reduced_plot = plot_input_data_reduced(value, plot_master, color_mask)
+            error_message = None
+        except JobQueueFullError as error:
+            reduced_plot, error_message = go.Figure(), str(error)
+
+    # the colors are those from the start of the job, recolor_data_reduced applies
+    # the current ones
+    return reduced_plot, error_message, time.time()
 
-    return reduced_plot, error_message
+
+@app.callback(
+    Output("reduced-graph", "figure", allow_duplicate=True),
+    Input("dendrogram-memory", "data"),
+    Input("reduced-graph-drawn", "data"),
+    State("plot_dropdown", "value"),
+    prevent_initial_call=True,
+)
+def recolor_data_reduced(data, _, value):
+    """
+    Clusters changed or a reduction finished, only recolor the points of the plot.
+    """
+    if value is None or data is None:
+        return no_update
+    reduced_plot = Patch()
+    reduced_plot["data"][0]["marker"]["color"] = [
+        data["color_map"][str(i)] for i in data["cluster_indices"]
+    ]
+    return reduced_plot
 
 
 @app.callback(
@@ -505,13 +1128,15 @@ def plot_data_reduced(value, data, highlight_area, merge_matrix_json):
     Input("save-button", "n_clicks"),
     prevent_initial_call=True,
 )
-def save_file(data, merge_matrix_json, n_clicks):
+def save_file(data, dataset_handle, n_clicks):
     if n_clicks != 0:
+        uploaded = stored_dataset(dataset_handle)
+        observation_clusters = uploaded.observation_clusters(data["cluster_indices"])
         return dcc.send_data_frame(
             pd.concat(
                 [
-                    pd.read_json(merge_matrix_json["dataset"], orient="split"),
-                    pd.DataFrame({"ASSIGNED_CLUSTER": data["cluster_indices"]}),
+                    uploaded.observations,
+                    pd.DataFrame({"ASSIGNED_CLUSTER": observation_clusters}),
                 ],
                 axis=1,
             ).to_csv,
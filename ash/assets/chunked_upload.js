@@ -0,0 +1,107 @@
+// Uploads the files chosen in a file dialog to the /upload route in chunks.
+// The upload id is derived from the names, sizes and modification times of the
+// files, so uploading the same files again resumes where the last attempt stopped.
+const UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024;
+const UPLOAD_RETRIES = 5;
+// the server accepts only these formats and names secure_filename leaves as they
+// are, see common/uploads.py
+const UPLOAD_FORMATS = [".csv", ".parquet", ".feather", ".arrow", ".npy", ".npz"];
+const SAFE_FILE_NAME = /^[A-Za-z0-9-]([A-Za-z0-9_.-]*[A-Za-z0-9-])?$/;
+
+function rejectedFile(file) {
+    const dot = file.name.lastIndexOf(".");
+    const extension = dot < 0 ? "" : file.name.slice(dot).toLowerCase();
+    if (!UPLOAD_FORMATS.includes(extension)) {
+        return `Unsupported file format ${file.name}`;
+    }
+    if (!SAFE_FILE_NAME.test(file.name)) {
+        return `Rename ${file.name}, only letters, digits, "-", "_" and "." are allowed`;
+    }
+    return null;
+}
+
+async function uploadIdOf(files) {
+    const description = files
+        .map((file) => `${file.name}:${file.size}:${file.lastModified}`)
+        .join("|");
+    const digest = await crypto.subtle.digest(
+        "SHA-1",
+        new TextEncoder().encode(description)
+    );
+    return Array.from(new Uint8Array(digest))
+        .map((byte) => byte.toString(16).padStart(2, "0"))
+        .join("");
+}
+
+async function uploadFile(uploadId, file) {
+    const url = `upload/${uploadId}/${encodeURIComponent(file.name)}`;
+    let status = await (await fetch(url)).json();
+    let failures = 0;
+    while (!status.complete) {
+        const start = status.received;
+        const end = Math.min(start + UPLOAD_CHUNK_BYTES, file.size);
+        try {
+            const response = await fetch(url, {
+                method: "PUT",
+                headers: {"Content-Range": `bytes ${start}-${end - 1}/${file.size}`},
+                body: file.slice(start, end),
+            });
+            if (!response.ok && response.status !== 409) {
+                throw new Error(`${file.name}: ${response.status}`);
+            }
+            // a refused chunk answers with the size the server has
+            status = await response.json();
+            failures = 0;
+        } catch (error) {
+            failures += 1;
+            if (failures > UPLOAD_RETRIES) {
+                throw error;
+            }
+            await new Promise((resolve) => setTimeout(resolve, 1000 * failures));
+            status = await (await fetch(url)).json();
+        }
+    }
+}
+
+async function uploadFiles(uploadId, files) {
+    try {
+        for (const file of files) {
+            await uploadFile(uploadId, file);
+        }
+    } catch (error) {
+        console.error("Upload failed, upload the files again to resume", error);
+    }
+}
+
+function chooseFiles() {
+    return new Promise((resolve) => {
+        const input = document.createElement("input");
+        input.type = "file";
+        input.multiple = true;
+        input.addEventListener("change", () => resolve(Array.from(input.files)));
+        input.addEventListener("cancel", () => resolve([]));
+        input.click();
+    });
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    upload: {
+        start_upload: async function () {
+            const files = (await chooseFiles()).filter((file) => file.size > 0);
+            if (!files.length) {
+                return window.dash_clientside.no_update;
+            }
+            const rejected = files.map(rejectedFile).filter((error) => error);
+            if (rejected.length) {
+                return {error: rejected.join(", ")};
+            }
+            const uploadId = await uploadIdOf(files);
+            // not awaited, the server reports the progress
+            uploadFiles(uploadId, files);
+            return {
+                id: uploadId,
+                files: files.map((file) => ({name: file.name, size: file.size})),
+            };
+        },
+    },
+});
@@ -0,0 +1,15 @@
+// Gives the browser tab a session id kept in its session storage, so tabs do not
+// share their split points. The server saves the state of the session under it.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    session: {
+        ensure_id: function (_, sessionId) {
+            if (sessionId) {
+                return window.dash_clientside.no_update;
+            }
+            const bytes = crypto.getRandomValues(new Uint8Array(16));
+            return Array.from(bytes)
+                .map((byte) => byte.toString(16).padStart(2, "0"))
+                .join("");
+        },
+    },
+});
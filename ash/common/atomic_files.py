@@ -0,0 +1,34 @@
+import os
+import shutil
+import tempfile
+
+
+def atomic_write(path: str, write, directory: bool = False) -> None:
+    """
+    Writes a file or folder under a temporary name next to it and renames it, so
+    other threads and processes never read it partially written.
+    :param write: called with the open binary file, or with the path of the
+        temporary folder when directory is set
+    :param directory: whether a folder is written, an existing folder is not
+        replaced and raises OSError
+    """
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    if directory:
+        temporary_path = tempfile.mkdtemp(dir=parent, prefix=".tmp")
+        try:
+            write(temporary_path)
+            os.rename(temporary_path, path)
+        except BaseException:
+            shutil.rmtree(temporary_path, ignore_errors=True)
+            raise
+        return
+
+    descriptor, temporary_path = tempfile.mkstemp(dir=parent, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            write(file)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
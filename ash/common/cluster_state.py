@@ -0,0 +1,245 @@
+from collections import Counter
+
+import numpy as np
+
+from common.linkage_index import LinkageIndex
+from common.process_cache import LRUCache
+
+DEFAULT_CLUSTER = 0
+# marks links whose children belong to different clusters
+MIXED_CLUSTERS = np.iinfo(np.int64).min
+
+CLUSTER_STATE_CACHE_SIZE = 32
+
+
+class ClusterChange:
+    """
+    Points and linkage rows whose cluster changed by a split or an unsplit
+    of the given node, together with the clusters the rows had before.
+    """
+
+    def __init__(
+        self,
+        node: int | None,
+        points: np.ndarray,
+        rows: np.ndarray,
+        previous_link_clusters: np.ndarray,
+    ):
+        self.node = node
+        self.points = points
+        self.rows = rows
+        self.previous_link_clusters = previous_link_clusters
+
+
+class ClusterState:
+    """
+    Cluster assignment of all points and links of one linkage for a list of split
+    points. A link belongs to a cluster when all leaves under it do, otherwise it is
+    MIXED_CLUSTERS. Splits and unsplits only touch the subtree of the given node and
+    the ancestors whose cluster actually changes.
+    """
+
+    def __init__(
+        self, index: LinkageIndex, split_points: list[int], cluster_ids: list[int]
+    ):
+        self.index = index
+        self.split_points = []
+        self.cluster_ids = []
+        # clusters of the points in the left-to-right leaf order
+        self.ordered_clusters = np.full(
+            index.nr_points, DEFAULT_CLUSTER, dtype=np.int64
+        )
+        for point, cluster_id in zip(split_points, cluster_ids):
+            start, end = index.interval(point)
+            self.ordered_clusters[start:end] = cluster_id
+            self.split_points.append(int(point))
+            self.cluster_ids.append(int(cluster_id))
+
+        self.link_clusters = np.empty(index.nr_links, dtype=np.int64)
+        self.link_clusters[:] = self._uniform_clusters(
+            0, index.nr_points, np.arange(index.nr_links)
+        )
+        values, counts = np.unique(self.ordered_clusters, return_counts=True)
+        self.cluster_sizes = Counter(dict(zip(values.tolist(), counts.tolist())))
+
+    def copy(self) -> "ClusterState":
+        state = ClusterState.__new__(ClusterState)
+        state.index = self.index
+        state.split_points = list(self.split_points)
+        state.cluster_ids = list(self.cluster_ids)
+        state.ordered_clusters = self.ordered_clusters.copy()
+        state.link_clusters = self.link_clusters.copy()
+        state.cluster_sizes = Counter(self.cluster_sizes)
+        return state
+
+    @property
+    def cluster_indices(self) -> np.ndarray:
+        return self.ordered_clusters[self.index.leaf_position]
+
+    @property
+    def clusters(self) -> list[int]:
+        return sorted(k for k, v in self.cluster_sizes.items() if v > 0)
+
+    def split(self, node_number: int, cluster_id: int) -> ClusterChange:
+        start, end = self.index.interval(node_number)
+        segment = np.full(end - start, int(cluster_id), dtype=np.int64)
+        self.split_points.append(int(node_number))
+        self.cluster_ids.append(int(cluster_id))
+        return self._update(node_number, segment)
+
+    def unsplit(self, node_number: int) -> ClusterChange:
+        remaining = [
+            (point, cluster_id)
+            for point, cluster_id in zip(self.split_points, self.cluster_ids)
+            if point != node_number
+        ]
+        self.split_points = [point for point, _ in remaining]
+        self.cluster_ids = [cluster_id for _, cluster_id in remaining]
+
+        # replay the remaining split points clipped to the subtree, intervals of two
+        # nodes are either nested or disjoint
+        start, end = self.index.interval(node_number)
+        segment = np.full(end - start, DEFAULT_CLUSTER, dtype=np.int64)
+        for point, cluster_id in remaining:
+            point_start, point_end = self.index.interval(point)
+            low, high = max(point_start, start), min(point_end, end)
+            if low < high:
+                segment[low - start : high - start] = cluster_id
+        return self._update(node_number, segment)
+
+    def _uniform_clusters(self, start: int, end: int, rows: np.ndarray) -> np.ndarray:
+        """
+        Clusters of the given links, all of them lying within leaf positions [start, end).
+        """
+        segment = self.ordered_clusters[start:end]
+        boundaries = np.concatenate(([0], np.cumsum(segment[1:] != segment[:-1])))
+        nodes = rows + self.index.nr_points
+        first = self.index.start[nodes] - start
+        last = self.index.end[nodes] - 1 - start
+        return np.where(
+            boundaries[first] == boundaries[last], segment[first], MIXED_CLUSTERS
+        )
+
+    def _node_cluster(self, node: int) -> int:
+        if node < self.index.nr_points:
+            return int(self.ordered_clusters[self.index.leaf_position[node]])
+        return int(self.link_clusters[node - self.index.nr_points])
+
+    def _update(self, node_number: int, segment: np.ndarray) -> ClusterChange:
+        index = self.index
+        start, end = index.interval(node_number)
+
+        previous = self.ordered_clusters[start:end].copy()
+        self.ordered_clusters[start:end] = segment
+        changed_positions = np.flatnonzero(previous != segment)
+        self.cluster_sizes.subtract(previous[changed_positions].tolist())
+        self.cluster_sizes.update(segment[changed_positions].tolist())
+
+        row = int(index.node_to_row[node_number])
+        rows = index.subtree_rows(row)
+        link_clusters = self._uniform_clusters(start, end, rows)
+        changed = link_clusters != self.link_clusters[rows]
+        changed_rows = [rows[changed]]
+        previous_link_clusters = [self.link_clusters[rows][changed]]
+        self.link_clusters[rows] = link_clusters
+
+        # walk up while the ancestors change
+        ancestors = []
+        previous_ancestor_clusters = []
+        node = int(index.parent[index.nr_points + row])
+        while node >= 0:
+            ancestor = node - index.nr_points
+            left = self._node_cluster(int(index.left[ancestor]))
+            right = self._node_cluster(int(index.right[ancestor]))
+            cluster = left if left == right else MIXED_CLUSTERS
+            if cluster == self.link_clusters[ancestor]:
+                break
+            previous_ancestor_clusters.append(self.link_clusters[ancestor])
+            self.link_clusters[ancestor] = cluster
+            ancestors.append(ancestor)
+            node = int(index.parent[node])
+        changed_rows.append(np.array(ancestors, dtype=np.int64))
+        previous_link_clusters.append(
+            np.array(previous_ancestor_clusters, dtype=np.int64)
+        )
+
+        return ClusterChange(
+            node_number,
+            index.leaf_order[start + changed_positions],
+            np.concatenate(changed_rows),
+            np.concatenate(previous_link_clusters),
+        )
+
+
+_STATE_CACHE = LRUCache(CLUSTER_STATE_CACHE_SIZE)
+
+
+def _state_key(index: LinkageIndex, split_points, cluster_ids):
+    return index.key, tuple(zip(map(int, split_points), map(int, cluster_ids)))
+
+
+def _cached_state(index: LinkageIndex, split_points, cluster_ids) -> ClusterState:
+    """
+    State for the split points from the cache, built and cached on a miss.
+    """
+    return _STATE_CACHE.get_or_build(
+        _state_key(index, split_points, cluster_ids),
+        lambda: ClusterState(index, split_points, cluster_ids),
+    )
+
+
+def _operation(previous_pairs: tuple, pairs: tuple) -> tuple | None:
+    """
+    The split or unsplit turning the previous split points into the current ones,
+    None when they differ by more than one of them.
+    """
+    if pairs[:-1] == previous_pairs and pairs:
+        return ("split", *pairs[-1])
+    removed = {point for point, _ in previous_pairs} - {point for point, _ in pairs}
+    if len(removed) == 1:
+        (point,) = removed
+        if tuple(pair for pair in previous_pairs if pair[0] != point) == pairs:
+            return ("unsplit", point)
+    return None
+
+
+def cluster_state_for(
+    index: LinkageIndex,
+    split_points: list[int],
+    cluster_ids: list[int],
+    previous: tuple[list[int], list[int]] | None = None,
+) -> tuple[ClusterState, ClusterChange | None]:
+    """
+    Returns the cluster state for the split points together with the change from the
+    previous split points of the caller. The change is None when there are no
+    previous split points or they differ by more than one added or removed point.
+    The change is derived from what the caller sends and not from what this process
+    saw last, so sessions and server processes sharing a dataset do not interfere.
+    Recent states are kept in an in-process LRU cache. Cached states are never
+    modified, a split or an unsplit updates a copy of the previous state, so states
+    handed out stay valid while other threads derive new ones.
+    :param previous: tuple (split points, cluster ids) the caller's current view
+        was built from
+    """
+    split_points = [int(point) for point in split_points]
+    cluster_ids = [int(cluster_id) for cluster_id in cluster_ids]
+    key = _state_key(index, split_points, cluster_ids)
+    if previous is None:
+        return _cached_state(index, split_points, cluster_ids), None
+
+    previous_key = _state_key(index, *previous)
+    if previous_key == key:
+        nothing = np.empty(0, dtype=np.int64)
+        state = _cached_state(index, split_points, cluster_ids)
+        return state, ClusterChange(None, nothing, nothing, nothing)
+    operation = _operation(previous_key[1], key[1])
+    if operation is None:
+        return _cached_state(index, split_points, cluster_ids), None
+
+    state = _cached_state(index, *previous).copy()
+    if operation[0] == "split":
+        change = state.split(operation[1], operation[2])
+    else:
+        change = state.unsplit(operation[1])
+    # another thread may have cached an equal state meanwhile, the change holds
+    return _STATE_CACHE.put(key, state), change
@@ -0,0 +1,179 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from scipy.cluster.hierarchy import fcluster, linkage
+from scipy.spatial.distance import cdist
+
+LINKAGE_METHODS = [
+    "complete",
+    "average",
+    "single",
+    "weighted",
+    "ward",
+    "centroid",
+    "median",
+]
+DISTANCE_METRICS = [
+    "euclidean",
+    "sqeuclidean",
+    "cityblock",
+    "chebyshev",
+    "cosine",
+    "correlation",
+]
+# methods that are only defined for euclidean distances
+EUCLIDEAN_METHODS = {"ward", "centroid", "median"}
+
+CLUSTERING_MODES = ["Exact", "Approximate", "Sharded"]
+# number of micro-clusters the approximate and sharded modes compress the rows into
+NR_MICRO_CLUSTERS = 2_000
+MICRO_CLUSTER_BATCH_SIZE = 4_096
+# largest number of rows an exact (sub-)dendrogram is computed for, see
+# compute_linkage for its memory
+MAX_EXACT_ROWS = 40_000
+# rows clustered exactly by one worker of the sharded mode
+SHARD_ROWS = 5_000
+
+# upper bound of the block of float64 distances one worker computes at once
+DISTANCE_CHUNK_BYTES = 32 * 2**20
+
+
+def condensed_distances(observations, metric: str = "euclidean", workers=None):
+    """
+    Pairwise distances between the rows of the observations in the condensed form
+    of scipy's pdist, written straight into the float64 array scipy's linkage
+    works on, so it is not converted or copied before clustering.
+    Blocks of rows are computed in parallel by a thread pool (cdist releases the
+    GIL), every block is at most DISTANCE_CHUNK_BYTES, so besides the result the
+    memory stays bounded by workers * DISTANCE_CHUNK_BYTES.
+    :param observations: n x features matrix
+    :param workers: number of threads, all cores by default
+    :return: float64 array of n * (n - 1) / 2 distances
+    """
+    observations = np.ascontiguousarray(observations, dtype=np.float64)
+    nr_rows = len(observations)
+    distances = np.empty(nr_rows * (nr_rows - 1) // 2, dtype=np.float64)
+    rows_per_chunk = max(1, DISTANCE_CHUNK_BYTES // (8 * max(nr_rows, 1)))
+
+    def fill(start: int):
+        stop = min(start + rows_per_chunk, nr_rows)
+        block = cdist(observations[start:stop], observations[start:], metric)
+        for row in range(start, stop):
+            # position of the pair (row, row + 1) in the condensed form
+            offset = row * nr_rows - row * (row + 1) // 2
+            distances[offset : offset + nr_rows - row - 1] = block[
+                row - start, row - start + 1 :
+            ]
+
+    with ThreadPoolExecutor(workers or os.cpu_count()) as executor:
+        list(executor.map(fill, range(0, nr_rows, rows_per_chunk)))
+    return distances
+
+
+def compute_linkage(
+    observations, method: str = "complete", metric: str = "euclidean", workers=None
+) -> np.ndarray:
+    """
+    Hierarchical clustering of the rows of the observations.
+    The condensed distances take 8 bytes per pair of rows. Except for single
+    linkage scipy clusters a copy of them, so the peak memory is 16 bytes per
+    pair, 3.2 GB for 20k and 12.8 GB for MAX_EXACT_ROWS = 40k rows.
+    :return: scipy linkage matrix
+    """
+    if method not in LINKAGE_METHODS:
+        raise ValueError(f"Unknown linkage method {method}")
+    if metric not in DISTANCE_METRICS:
+        raise ValueError(f"Unknown distance metric {metric}")
+    if method in EUCLIDEAN_METHODS and metric != "euclidean":
+        raise ValueError(f"{method} linkage needs euclidean distances")
+
+    return linkage(condensed_distances(observations, metric, workers), method=method)
+
+
+def micro_clusters(
+    observations, nr_clusters: int = NR_MICRO_CLUSTERS, random_state: int = 0
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Compresses the observations into micro-clusters by mini-batch k-means, which
+    reads MICRO_CLUSTER_BATCH_SIZE rows at a time, so the memory stays linear in
+    the number of rows. Micro-clusters left without members are dropped.
+    :param observations: n x features matrix
+    :return: tuple (centroids, members) where members[i] is the micro-cluster
+        (row of the centroids) of the i-th observation
+    """
+    # imported here, scikit-learn takes long to import and is rarely needed
+    from sklearn.cluster import MiniBatchKMeans
+
+    observations = np.asarray(observations, dtype=np.float64)
+    kmeans = MiniBatchKMeans(
+        n_clusters=min(nr_clusters, len(observations)),
+        batch_size=MICRO_CLUSTER_BATCH_SIZE,
+        n_init=3,
+        random_state=random_state,
+    ).fit(observations)
+    used, members = np.unique(kmeans.labels_, return_inverse=True)
+    return kmeans.cluster_centers_[used], members
+
+
+def _summarize_shard(shard, method, metric, cut_height, nr_subtrees):
+    """
+    Clusters one shard exactly and cuts its dendrogram into subtrees.
+    :return: tuple (centroids, members) of the subtrees of the shard
+    """
+    merge_matrix = compute_linkage(shard, method, metric, workers=1)
+    if cut_height is None:
+        subtrees = fcluster(merge_matrix, nr_subtrees, criterion="maxclust")
+    else:
+        subtrees = fcluster(merge_matrix, cut_height, criterion="distance")
+    _, members = np.unique(subtrees, return_inverse=True)
+    sizes = np.bincount(members)
+    centroids = np.stack(
+        [np.bincount(members, weights=column) for column in shard.T], axis=1
+    )
+    return centroids / sizes[:, None], members
+
+
+def shard_clusters(
+    observations,
+    method: str = "complete",
+    metric: str = "euclidean",
+    cut_height: float | None = None,
+    workers=None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Clusters consecutive shards of SHARD_ROWS observations exactly in a process
+    pool and summarizes every shard by the centroids of its subtrees, the subtrees
+    are cut at cut_height or, by default, so that all shards together give about
+    NR_MICRO_CLUSTERS of them.
+    :param observations: n x features matrix
+    :param workers: number of processes, all cores by default
+    :return: tuple (centroids, members) as in micro_clusters, the subtrees of the
+        first shard come first
+    """
+    observations = np.asarray(observations, dtype=np.float64)
+    nr_shards = max(1, -(-len(observations) // SHARD_ROWS))
+    shards = np.array_split(observations, nr_shards)
+    nr_subtrees = max(1, NR_MICRO_CLUSTERS // nr_shards)
+
+    with ProcessPoolExecutor(min(workers or os.cpu_count(), nr_shards)) as executor:
+        summaries = list(
+            executor.map(
+                _summarize_shard,
+                shards,
+                [method] * nr_shards,
+                [metric] * nr_shards,
+                [cut_height] * nr_shards,
+                [nr_subtrees] * nr_shards,
+            )
+        )
+
+    offsets = np.cumsum([0] + [len(centroids) for centroids, _ in summaries])
+    centroids = np.concatenate([centroids for centroids, _ in summaries])
+    members = np.concatenate(
+        [
+            shard_members + offset
+            for (_, shard_members), offset in zip(summaries, offsets)
+        ]
+    )
+    return centroids, members
@@ -1,13 +1,64 @@
 import base64
 import io
+import os
 
+import numpy as np
 import pandas as pd
 
+UPLOAD_FORMATS = [".csv", ".parquet", ".feather", ".arrow", ".npy", ".npz"]
+
+
+def uploaded_content_to_bytes(content) -> bytes:
+    content_type, content_string = content.split(",", 1)
+    return base64.b64decode(content_string)
+
 
 def uploaded_content_to_df(content) -> pd.DataFrame:
-    content_type, content_string = content.split(",")
-    decoded = base64.b64decode(content_string)
-    return pd.read_csv(io.StringIO(decoded.decode("utf-8")))
+    # pandas parses the bytes, there is no decoded text copy of the file
+    return pd.read_csv(io.BytesIO(uploaded_content_to_bytes(content)))
+
+
+def array_to_df(array, columns=None) -> pd.DataFrame:
+    array = np.asarray(array)
+    if columns is None:
+        columns = [f"V{i + 1}" for i in range(array.shape[1])]
+    return pd.DataFrame(array, columns=[str(column) for column in columns])
+
+
+def read_upload(source, filename: str) -> dict:
+    """
+    Reads an uploaded file straight from its bytes, the format is given by the
+    file extension. Tables are named by the file name without the extension,
+    e.g. merge.csv gives "merge". A scipy linkage matrix is uploaded as
+    linkage.npy or as the "linkage" array of data.npz, next to its "data" and
+    optional "columns" arrays.
+    :param source: path or binary file object
+    :return: uploaded tables by name, data as a DataFrame, a linkage as an array
+    """
+    name, extension = os.path.splitext(filename)
+    extension = extension.lower()
+    if extension not in UPLOAD_FORMATS:
+        raise ValueError(f"Unsupported file format {filename}")
+
+    if extension == ".npz":
+        with np.load(source, allow_pickle=False) as arrays:
+            tables = {
+                key: arrays[key]
+                for key in arrays.files
+                if key not in ("data", "columns")
+            }
+            if "data" in arrays.files:
+                columns = arrays["columns"] if "columns" in arrays.files else None
+                tables["data"] = array_to_df(arrays["data"], columns)
+        return tables
+    if extension == ".npy":
+        array = np.load(source, allow_pickle=False)
+        return {name: array if name == "linkage" else array_to_df(array)}
+    if extension == ".parquet":
+        return {name: pd.read_parquet(source)}
+    if extension in (".feather", ".arrow"):
+        return {name: pd.read_feather(source)}
+    return {name: pd.read_csv(source)}
 
 
 def validate_data(df: pd.DataFrame) -> bool:
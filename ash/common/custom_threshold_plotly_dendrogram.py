@@ -3,121 +3,113 @@ from __future__ import absolute_import
 from collections import OrderedDict
 
 import numpy as np
-import scipy
 
+from common.cluster_state import (MIXED_CLUSTERS, ClusterChange, ClusterState,
+                                  cluster_state_for)
 from common.color_mappings import (COLORBLIND_PALETTE,
                                    KELLY_MAX_CONTRAST_PALETTE)
+from common.linkage_index import get_linkage_index
 from common.util import indexable_cycle
 
-
-def iterate_linkage(linkage, start_index, nr_points, known_points):
-    """
-    Recursive functions which returns a tuple of point indices under a given split point or calls itself
-    Known points is a tuple of points which are already known to be under a given split point. those are appended to the new tuple
-    :param linkage:
-    :param start_index:
-    :param nr_points:
-    :param known_points:
-    :return:
-    """
-    if start_index < nr_points:
-        return known_points + (int(start_index),)
-
-    else:
-        reversed_index = int(start_index - nr_points)
-        left = linkage[reversed_index][0]
-        right = linkage[reversed_index][1]
-
-        return iterate_linkage(
-            linkage, left, nr_points, known_points
-        ) + iterate_linkage(linkage, right, nr_points, known_points)
+DEFAULT_LINK_COLOR = "#808080"
+SPLIT_POINT_MARKER = dict(color="red", size=15, symbol="x")
+NODE_MARKER = dict(size=6, symbol="circle")
 
 
-def cluster_with_implicit_split_points(
-    link_mat: np.ndarray, split_points: list[int], cluster_ids: list[int]
-):
-    next_cluster_index = 0
-    nr_points = link_mat.shape[0] + 1
-    initial_cluster_assignments = [next_cluster_index] * nr_points
-    user_defined_cluster_indices = iter(cluster_ids)
-
-    # linkage matrix is sorted by distance
+def link_color(cluster, palette):
+    if cluster == MIXED_CLUSTERS:
+        return DEFAULT_LINK_COLOR
+    return indexable_cycle(palette, cluster)
 
-    for point in split_points:
-        next_cluster_index = next(user_defined_cluster_indices)
-        reversed_index = int(nr_points - point - 1)
-        left = link_mat[reversed_index][0]
-        right = link_mat[reversed_index][1]
 
-        indices = iterate_linkage(link_mat, left, nr_points, tuple()) + iterate_linkage(
-            link_mat, right, nr_points, tuple()
-        )
+def link_colors(state: ClusterState, palette) -> np.ndarray:
+    """
+    Colors of all links ordered by node number from the bottom of the dendrogram.
+    """
+    clusters = state.link_clusters[state.index.sorted_rows]
+    colors = np.array(palette, dtype=object)[clusters % len(palette)]
+    colors[clusters == MIXED_CLUSTERS] = DEFAULT_LINK_COLOR
+    return colors
 
-        for index in indices:
-            initial_cluster_assignments[index] = next_cluster_index
 
-    return initial_cluster_assignments
+def link_slots(palette) -> list[str]:
+    """
+    Colors of the line traces of a consolidated dendrogram, one trace per color.
+    """
+    return list(dict.fromkeys([*palette, DEFAULT_LINK_COLOR]))
 
 
-def split_dendrogram(linkage_matrix, monocrit, cluster_ids, palette):
+def link_slot_trace(xs, ys, color) -> dict:
     """
-    The function create scipy dendrogram object, so that
-    link colors matches monocrit split criteria
+    All shapes of one color in a single line trace, shapes are separated by gaps.
+    xs and ys hold one shape per row, the four corners of a '∩' for a link.
     """
-    dflt_col = "#808080"
-
-    cluster_indices = cluster_with_implicit_split_points(
-        linkage_matrix, monocrit, cluster_ids
+    gap = np.full((len(xs), 1), np.nan)
+    return dict(
+        type="scattergl",
+        x=np.hstack([xs, gap]).ravel(),
+        y=np.hstack([ys, gap]).ravel(),
+        mode="lines",
+        line=dict(color=color),
+        hoverinfo="skip",
     )
 
-    # 2 create color map
-    color_map = {
-        cluster: indexable_cycle(palette, cluster) for cluster in set(cluster_indices)
-    }
-    point_color_map = {}
-    for nr, p in enumerate(cluster_indices):
-        point_color_map[nr] = color_map[p]
-    # 3 apply color map
-    link_cols = {}
-    for i, i12 in enumerate(linkage_matrix[:, :2].astype(int)):
-        c1, c2 = (
-            link_cols[x] if x > len(linkage_matrix) else point_color_map[x] for x in i12
-        )
-        link_cols[i + 1 + len(linkage_matrix)] = c1 if c1 == c2 else dflt_col
-    return (
-        scipy.cluster.hierarchy.dendrogram(
-            Z=linkage_matrix, link_color_func=lambda x: link_cols[x]
+
+def node_marker_trace(xs, ys, colors, node_numbers, monocrit_list, text=None) -> dict:
+    """
+    Midpoints of all links in a single marker trace, the node number is carried
+    in the hovertext and in customdata so that clicking a node splits it.
+    """
+    split = np.isin(node_numbers, monocrit_list)
+    trace = dict(
+        type="scattergl",
+        x=(xs[:, 1] + xs[:, 2]) / 2,
+        y=(ys[:, 1] + ys[:, 2]) / 2,
+        mode="markers",
+        marker=dict(
+            color=np.where(split, SPLIT_POINT_MARKER["color"], colors).tolist(),
+            size=np.where(split, SPLIT_POINT_MARKER["size"], NODE_MARKER["size"]),
+            symbol=np.where(
+                split, SPLIT_POINT_MARKER["symbol"], NODE_MARKER["symbol"]
+            ).tolist(),
         ),
-        cluster_indices,
-        # numpy int is not serializable, therefore color_map cannot be simpy returned
-        {int(k): v for k, v in color_map.items()},
+        hoverinfo="text",
+        hovertext=[f"Node {node}" for node in node_numbers],
+        customdata=node_numbers,
     )
+    if text is not None:
+        trace["text"] = text
+    return trace
 
 
-def sort_dendrogram(dendrogram):
-    def sorting_key(i):
-        return max(i[2])
-
-    s = sorted(
-        zip(
-            dendrogram["color_list"],
-            dendrogram["icoord"],
-            dendrogram["dcoord"],
-            dendrogram["ivl"],
-            dendrogram["leaves"],
-            dendrogram["leaves_color_list"],
-        ),
-        key=sorting_key,
+def consolidated_traces(
+    xs, ys, colors, node_numbers, monocrit_list, palette, text=None
+) -> list[dict]:
+    """
+    Dendrogram drawn with one line trace per color of the palette plus the default
+    link color, followed by one marker trace with the midpoints of all links.
+    """
+    colors = np.asarray(colors, dtype=object)
+    traces = [
+        link_slot_trace(xs[colors == color], ys[colors == color], color)
+        for color in link_slots(palette)
+    ]
+    traces.append(
+        node_marker_trace(xs, ys, colors, node_numbers, monocrit_list, text=text)
     )
+    return traces
+
 
-    return {
-        "color_list": [i[0] for i in s],
-        "icoord": [i[1] for i in s],
-        "dcoord": [i[2] for i in s],
-        "ivl": [i[3] for i in s],
-        "leaves": [i[4] for i in s],
-        "leaves_color_list": [i[5] for i in s],
-    }
+def touched_link_colors(
+    state: ClusterState, change: ClusterChange, palette
+) -> list[str]:
+    """
+    Colors whose line traces gained or lost links by a split or an unsplit.
+    """
+    clusters = np.concatenate(
+        [change.previous_link_clusters, state.link_clusters[change.rows]]
+    )
+    return sorted({link_color(cluster, palette) for cluster in clusters.tolist()})
 
 
 def create_dendrogram_modified(
@@ -126,9 +118,15 @@ def create_dendrogram_modified(
     labels=None,
     hovertext=None,
     colorblind_palette=False,
-    monocrit_list=[],
-    cluster_ids=[],
+    monocrit_list=None,
+    cluster_ids=None,
+    consolidated=True,
 ):
+    """
+    Builds the dendrogram of the linkage matrix Z colored by the split points.
+    Safe to call from several threads at once: it does not touch the plotly
+    dendrogram class, and the caches it reads are locked and never modified in place.
+    """
     dendrogram = _Dendrogram_Modified(
         Z,
         orientation,
@@ -137,6 +135,7 @@ def create_dendrogram_modified(
         colorblind_palette=colorblind_palette,
         monocrit_list=monocrit_list,
         cluster_ids=cluster_ids,
+        consolidated=consolidated,
     )
     return dendrogram
 
@@ -153,8 +152,9 @@ class _Dendrogram_Modified:
         yaxis="yaxis",
         hovertext=None,
         colorblind_palette=False,
-        monocrit_list=[],
-        cluster_ids=[],
+        monocrit_list=None,
+        cluster_ids=None,
+        consolidated=True,
     ):
         self.orientation = orientation
         self.labels = labels
@@ -169,8 +169,10 @@ class _Dendrogram_Modified:
             self.palette = COLORBLIND_PALETTE
         else:
             self.palette = KELLY_MAX_CONTRAST_PALETTE
-        self.monocrit_list = monocrit_list
-        self.cluster_ids = cluster_ids
+        self.monocrit_list = monocrit_list or []
+        self.cluster_ids = cluster_ids or []
+        # one trace per link color instead of two traces per link
+        self.consolidated = consolidated
 
         if self.orientation in ["left", "bottom"]:
             self.sign[self.xaxis] = 1
@@ -197,33 +199,15 @@ class _Dendrogram_Modified:
         self.leaves = leaves
         self.leaves_color_map_translated = leaves_color_map_translated
         self.clusters = clusters
-        yvals_flat = yvals.flatten()
-        xvals_flat = xvals.flatten()
 
         self.xvals = xvals
         self.yvals = yvals
 
         self.dendro = dendro
 
-        self.zero_vals = []
-
-        for i in range(len(yvals_flat)):
-            if yvals_flat[i] == 0.0 and xvals_flat[i] not in self.zero_vals:
-                self.zero_vals.append(xvals_flat[i])
-
-        if len(self.zero_vals) > len(yvals) + 1:
-            # If the length of zero_vals is larger than the length of yvals,
-            # it means that there are wrong vals because of the identicial samples.
-            # Three and more identicial samples will make the yvals of spliting
-            # center into 0 and it will accidentally take it as leaves.
-            l_border = int(min(self.zero_vals))
-            r_border = int(max(self.zero_vals))
-            correct_leaves_pos = range(
-                l_border, r_border + 1, int((r_border - l_border) / len(yvals))
-            )
-            # Regenerating the leaves pos from the self.zero_vals with equally intervals.
-            self.zero_vals = [v for v in correct_leaves_pos]
-        self.zero_vals.sort()
+        # leaves are 10 apart starting at 5, known from the layout of the tree, so
+        # identical samples joined at height 0 are not taken for leaves
+        self.zero_vals = (5.0 + 10.0 * np.arange(len(leaves))).tolist()
         self.layout = self.set_figure_layout()
         self.data = dd_traces
 
@@ -297,86 +281,109 @@ class _Dendrogram_Modified:
             (e) P['leaves']: left-to-right traversal of the leaves
 
         """
-        Z = np.asarray(Z)
-        cut_points = np.zeros((Z.shape[0],))
-        inverted_monocrit = [-i for i in self.monocrit_list]
-        cut_points[inverted_monocrit] = 1
-
-        # We need to sort links in order to color them properly
-        dendrogram, cluster_indices, color_map = split_dendrogram(
-            Z, self.monocrit_list, self.cluster_ids, self.palette
-        )
-        self.cluster_indices = cluster_indices
-        self.color_map = color_map
-        P = sort_dendrogram(dendrogram)
+        # the geometry is cached per linkage matrix and the clusters per split
+        # points, a change of the palette only maps the clusters to other colors
+        index = get_linkage_index(Z)
+        state, _ = cluster_state_for(index, self.monocrit_list, self.cluster_ids)
+        self.cluster_indices = state.cluster_indices.tolist()
+        self.color_map = {
+            cluster: indexable_cycle(self.palette, cluster)
+            for cluster in state.clusters
+        }
         # that is simply an integer that denotes number of clusters
-        clusters = len(set(cluster_indices))
+        clusters = len(state.clusters)
         # icoord is list of x coordinates for each '∩' shape - that is 4 values, because '∩' has for vertices
-        icoord = scipy.array(P["icoord"])
         # dcoord is list of y coordinates for each '∩' shape - that is 4 values, because '∩' has for vertices
-        dcoord = scipy.array(P["dcoord"])
-
-        ordered_labels = scipy.array(P["ivl"])
-        color_list = list(P["color_list"])
+        # both are sorted by the height of the links, as the node numbers are
+        icoord, dcoord = index.link_coordinates()
+
+        leaves = index.leaf_order.tolist()
+        ordered_labels = np.array([str(leaf) for leaf in leaves])
+        color_list = link_colors(state, self.palette)
+        P = {
+            "color_list": color_list,
+            "icoord": icoord,
+            "dcoord": dcoord,
+            "ivl": ordered_labels,
+            "leaves": leaves,
+        }
         trace_list = []
-        for i in range(len(icoord)):
-            # xs and ys are arrays of 4 points that make up the '∩' shapes
-            # of the dendrogram tree
-            if self.orientation in ["top", "bottom"]:
-                xs = icoord[i]
-            else:
-                xs = dcoord[i]
 
+        try:
+            x_index = int(self.xaxis[-1])
+        except ValueError:
+            x_index = ""
+
+        try:
+            y_index = int(self.yaxis[-1])
+        except ValueError:
+            y_index = ""
+
+        if self.consolidated:
             if self.orientation in ["top", "bottom"]:
-                ys = dcoord[i]
+                xs, ys = icoord, dcoord
             else:
-                ys = icoord[i]
-
-            hovertext_label = None
-            if hovertext:
-                hovertext_label = hovertext[i]
-            trace = dict(
-                type="scatter",
-                x=np.multiply(self.sign[self.xaxis], xs),
-                y=np.multiply(self.sign[self.yaxis], ys),
-                mode="lines",
-                marker=dict(color=P["color_list"][i]),
-                hoverinfo="skip",
+                xs, ys = dcoord, icoord
+            trace_list = consolidated_traces(
+                np.multiply(self.sign[self.xaxis], xs).reshape(-1, 4),
+                np.multiply(self.sign[self.yaxis], ys).reshape(-1, 4),
+                color_list,
+                np.arange(len(icoord), 0, -1),
+                self.monocrit_list,
+                self.palette,
+                text=hovertext,
             )
-            try:
-                x_index = int(self.xaxis[-1])
-            except ValueError:
-                x_index = ""
-
-            try:
-                y_index = int(self.yaxis[-1])
-            except ValueError:
-                y_index = ""
-
-            trace["xaxis"] = "x" + x_index
-            trace["yaxis"] = "y" + y_index
-
-            trace_list.append(trace)
-            # append midpoint labels
-            markers = dict(color=P["color_list"][i])
-            if (len(icoord) - i) in self.monocrit_list:
-                markers = dict(color="red", size=15, symbol="x")
-            trace_list.append(
-                dict(
+            for trace in trace_list:
+                trace["xaxis"] = "x" + x_index
+                trace["yaxis"] = "y" + y_index
+        else:
+            for i in range(len(icoord)):
+                # xs and ys are arrays of 4 points that make up the '∩' shapes
+                # of the dendrogram tree
+                if self.orientation in ["top", "bottom"]:
+                    xs = icoord[i]
+                else:
+                    xs = dcoord[i]
+
+                if self.orientation in ["top", "bottom"]:
+                    ys = dcoord[i]
+                else:
+                    ys = icoord[i]
+
+                hovertext_label = None
+                if hovertext:
+                    hovertext_label = hovertext[i]
+                trace = dict(
                     type="scatter",
-                    x=[(xs[1] + xs[2]) / 2],
-                    y=[(ys[1] + ys[2]) / 2],
-                    mode="markers",
-                    marker=markers,
-                    text=hovertext_label,
-                    hoverinfo="text",
-                    hovertext=[f"Node {len(icoord) - i}"],
+                    x=np.multiply(self.sign[self.xaxis], xs),
+                    y=np.multiply(self.sign[self.yaxis], ys),
+                    mode="lines",
+                    marker=dict(color=color_list[i]),
+                    hoverinfo="skip",
+                )
+                trace["xaxis"] = "x" + x_index
+                trace["yaxis"] = "y" + y_index
+
+                trace_list.append(trace)
+                # append midpoint labels
+                markers = dict(color=color_list[i])
+                if (len(icoord) - i) in self.monocrit_list:
+                    markers = SPLIT_POINT_MARKER
+                trace_list.append(
+                    dict(
+                        type="scatter",
+                        x=[(xs[1] + xs[2]) / 2],
+                        y=[(ys[1] + ys[2]) / 2],
+                        mode="markers",
+                        marker=markers,
+                        text=hovertext_label,
+                        hoverinfo="text",
+                        hovertext=[f"Node {len(icoord) - i}"],
+                    )
                 )
-            )
 
         leaves_color_list_translated = OrderedDict()
 
-
         return (
             P,
             trace_list,
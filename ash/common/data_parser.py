@@ -1,6 +1,8 @@
 import os
 
+import numpy as np
 import pandas as pd
+from scipy.cluster.hierarchy import from_mlab_linkage
 
 DATA_FOLDER = os.path.join(os.getcwd(), "common", "user_data")
 #DATA_FOLDER = "/app/ash/common/user_data"
@@ -9,8 +11,8 @@ DATA_FOLDER = os.path.join(os.getcwd(), "common", "user_data")
 class RDataParser:
     def __init__(self):
         self.dataset = self.read_dataset()
-        self.merge_matrix = [map(float, x) for x in self.read_merge_matrix()]
-        self.joining_height = [float(x) for x in self.read_joining_height()]
+        self.merge_matrix = self.read_merge_matrix()
+        self.joining_height = self.read_joining_height()
         self.order = [float(x) for x in self.read_order_data()]
         self.labels = self.read_labels()
 
@@ -28,17 +30,14 @@ class RDataParser:
 
     @staticmethod
     def read_joining_height():
-        return pd.read_csv(os.path.join(DATA_FOLDER, "heights.csv"))[
-            "x"
-        ].values.tolist()
+        return pd.read_csv(os.path.join(DATA_FOLDER, "heights.csv"))["x"].to_numpy(
+            dtype=np.float64
+        )
 
     @staticmethod
     def read_merge_matrix():
         merge_matrix_raw = pd.read_csv(os.path.join(DATA_FOLDER, "merge.csv"))
-        merge_matrix_V1 = merge_matrix_raw["V1"].values.tolist()
-        merge_matrix_V2 = merge_matrix_raw["V2"].values.tolist()
-        merge_matrix = [list(x) for x in zip(merge_matrix_V1, merge_matrix_V2)]
-        return merge_matrix
+        return merge_matrix_raw[["V1", "V2"]].to_numpy(dtype=np.int64)
 
     def read_labels(self):
         try:
@@ -47,59 +46,42 @@ class RDataParser:
             labels = [i for i in range(len(self.order))]
         return labels
 
-    def convert_merge_matrix(self):
-        transformed_matrix = []
-        for node in self.merge_matrix:
-            new_node = []
-            for el in node:
-                if el < 0:
-                    transformed_el = abs(el) - 1
-                else:
-                    transformed_el = el + len(self.merge_matrix)
-                new_node.append(transformed_el)
-            transformed_matrix.append(new_node)
-
-        self.merge_matrix = transformed_matrix
-
-    def add_joining_height(self):
-        for index in range(len(self.merge_matrix)):
-            self.merge_matrix[index].append(self.joining_height[index])
-            self.merge_matrix[index].append(self.order[index])
-
     def parse(self):
-        self.convert_merge_matrix()
-        self.add_joining_height()
-
-
-def merge_matrix_from_R_to_scipy_format(merge_matrix: list) -> list:
-    scipy_matrix = []
-    for row in merge_matrix:
-        new_node = []
-        for element in row:
-            if element < 0:
-                transformed_el = abs(element) - 1
-            else:
-                transformed_el = element + len(merge_matrix)
-            new_node.append(transformed_el)
-        scipy_matrix.append(new_node)
-    return scipy_matrix
-
-
-def parse_merge_df(merge_raw: pd.DataFrame, parsed_heights, parsed_order) -> list:
-    print(merge_raw.head())
-    first_col = merge_raw.iloc[:, 0].values.tolist()
-    second_col = merge_raw.iloc[:, 1].values.tolist()
-    merge_matrix_as_list = [
-        [float(x_1), float(x_2)] for x_1, x_2 in zip(first_col, second_col)
-    ]
-
-    merge_matrix = merge_matrix_from_R_to_scipy_format(merge_matrix_as_list)
-
-    for i in range(len(merge_matrix)):
-        merge_matrix[i].append(parsed_heights[i])
-        merge_matrix[i].append(parsed_order[i])
-
-    return merge_matrix
+        self.merge_matrix = r_hclust_to_linkage(self.merge_matrix, self.joining_height)
+
+
+def r_hclust_to_linkage(merge, heights) -> np.ndarray:
+    """
+    Converts the merge matrix and the joining heights of an R hclust object to
+    a scipy linkage matrix.
+    :param merge: (n-1) x 2 merge matrix of hclust
+    :param heights: n-1 joining heights of hclust
+    :return: float64 (n-1) x 4 array with the two joined nodes, the joining height
+        and the number of points in the new cluster
+    :raises ValueError: when a merge joins a point or merge that does not exist
+    """
+    merge = np.asarray(merge, dtype=np.int64)
+    nr_links = len(merge)
+    if nr_links == 0:
+        return np.empty((0, 4), dtype=np.float64)
+    # R numbers the points -1..-n and the merges 1..n-1, a merge only joins the
+    # merges before it
+    formed = np.arange(nr_links)[:, np.newaxis]
+    if ((merge == 0) | (merge < -(nr_links + 1)) | (merge > formed)).any():
+        raise ValueError("The merge matrix is not an hclust merge matrix")
+
+    # MATLAB numbers the points 1..n and the links n+1..2n-1, scipy converts that
+    # format and counts the cluster sizes in compiled code
+    mlab = np.empty((nr_links, 3), dtype=np.float64)
+    mlab[:, :2] = np.where(merge < 0, -merge, merge + nr_links + 1)
+    mlab[:, 2] = np.asarray(heights, dtype=np.float64)
+    return from_mlab_linkage(mlab)
+
+
+def parse_merge_df(merge_raw: pd.DataFrame, parsed_heights) -> np.ndarray:
+    return r_hclust_to_linkage(
+        merge_raw.iloc[:, :2].to_numpy(dtype=np.int64), parsed_heights
+    )
 
 
 def parse_order_df(order_raw: pd.DataFrame) -> list:
@@ -0,0 +1,310 @@
+import hashlib
+import os
+import re
+import shutil
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+from common.atomic_files import atomic_write
+from common.linkage_index import LinkageIndex, get_linkage_index
+from common.process_cache import ForkSafeLock, LRUCache
+from common.session_store import evict, register_dataset, touch_dataset
+
+DATASET_CACHE_SIZE = 8
+# datasets written as .npy files, memory-mapped by every server process
+DATASET_FOLDER = os.path.join(os.getcwd(), "common", "user_data", "datasets")
+
+_DATASET_KEY = re.compile(r"^[0-9a-f]{40}$")
+
+
+class DatasetNotFoundError(KeyError):
+    """
+    The handle refers to a dataset that is neither held by this server process nor
+    saved in the dataset folder.
+    """
+
+
+class StoredDataset:
+    """
+    An uploaded dataset together with its clustering, kept in server memory.
+    The browser only holds the handle of the dataset.
+
+    Artifacts derived from the dataset are built on first use and live as long as
+    the dataset stays in the cache, so every callback of one interaction shares them.
+
+    In the approximate mode the rows of the dataset are micro-cluster centroids, the
+    uploaded observations are kept in points and members maps every observation to
+    its micro-cluster.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        dataset: pd.DataFrame,
+        merge_matrix,
+        labels,
+        order,
+        points: pd.DataFrame | None = None,
+        members=None,
+    ):
+        self.key = key
+        self.dataset = dataset
+        self.merge_matrix = np.asarray(merge_matrix, dtype=np.float64)
+        self.labels = list(labels)
+        self.order = list(order)
+        self.points = points
+        self.members = None if members is None else np.asarray(members, dtype=np.int64)
+        self._artifacts = {}
+        self._artifacts_lock = ForkSafeLock()
+        # one lock per artifact, different artifacts are built in parallel
+        self._build_locks = {}
+
+    def artifact(self, name: str, build):
+        """
+        Returns the artifact of the given name, calling build() only the first time.
+        """
+        with self._artifacts_lock:
+            if name in self._artifacts:
+                return self._artifacts[name]
+            build_lock = self._build_locks.get(name)
+            if build_lock is None:
+                build_lock = self._build_locks[name] = ForkSafeLock()
+
+        with build_lock:
+            with self._artifacts_lock:
+                if name in self._artifacts:
+                    return self._artifacts[name]
+            value = build()
+            with self._artifacts_lock:
+                self._artifacts[name] = value
+            return value
+
+    def has_artifact(self, name: str) -> bool:
+        with self._artifacts_lock:
+            return name in self._artifacts
+
+    @property
+    def approximate(self) -> bool:
+        return self.members is not None
+
+    @property
+    def observations(self) -> pd.DataFrame:
+        """
+        The uploaded observations, the dataset itself unless it is approximate.
+        """
+        return self.points if self.approximate else self.dataset
+
+    def observation_clusters(self, cluster_indices) -> np.ndarray:
+        """
+        Cluster of every uploaded observation, the members of a micro-cluster
+        belong to its cluster.
+        :param cluster_indices: cluster of every row of the dataset
+        """
+        cluster_indices = np.asarray(cluster_indices)
+        if self.approximate:
+            return cluster_indices[self.members]
+        return cluster_indices
+
+    @property
+    def linkage_index(self) -> LinkageIndex:
+        return self.artifact(
+            "linkage_index", lambda: get_linkage_index(self.merge_matrix)
+        )
+
+    @property
+    def ordered_dataset(self) -> pd.DataFrame:
+        """
+        Dataset with rows in the left-to-right order of the dendrogram leaves.
+        """
+        return self.artifact(
+            "ordered_dataset",
+            lambda: self.dataset.iloc[self.linkage_index.leaf_order],
+        )
+
+    @property
+    def feature_matrix(self) -> np.ndarray:
+        """
+        Read-only float matrix of the dataset, one row per observation.
+        """
+
+        def build():
+            matrix = self.dataset.to_numpy(dtype=np.float64)
+            matrix.flags.writeable = False
+            return matrix
+
+        return self.artifact("feature_matrix", build)
+
+    @property
+    def handle(self) -> dict:
+        return {
+            "key": self.key,
+            "shape": list(self.dataset.shape),
+            "columns": self.dataset.columns.tolist(),
+        }
+
+
+def dataset_key(
+    dataset: pd.DataFrame, merge_matrix, labels, order, members=None
+) -> str:
+    """
+    Content hash of a dataset and its clustering, equal uploads share one entry.
+    """
+    digest = hashlib.sha1(repr(dataset.columns.tolist()).encode())
+    digest.update(pd.util.hash_pandas_object(dataset, index=True).values.tobytes())
+    digest.update(np.ascontiguousarray(merge_matrix, dtype=np.float64).tobytes())
+    digest.update(repr(list(labels)).encode())
+    digest.update(np.asarray(order, dtype=np.float64).tobytes())
+    if members is not None:
+        digest.update(np.ascontiguousarray(members, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+def save_dataset(stored: StoredDataset, folder: str = DATASET_FOLDER) -> bool:
+    """
+    Writes the arrays of the dataset as .npy files to a folder named by its key.
+    Datasets with non-numeric columns or labels are only kept in memory.
+    Saving a dataset evicts expired and least recently used ones from the folder.
+    :return: whether the dataset is saved
+    """
+    path = os.path.join(folder, stored.key)
+    if os.path.isdir(path):
+        touch_dataset(stored.key)
+        return True
+    frames = {"dataset": stored.dataset}
+    if stored.approximate:
+        frames["points"] = stored.points
+    if not all(
+        is_numeric_dtype(dtype) for frame in frames.values() for dtype in frame.dtypes
+    ):
+        return False
+
+    arrays = {
+        "merge_matrix": stored.merge_matrix,
+        "labels": np.asarray(stored.labels),
+        "order": np.asarray(stored.order, dtype=np.float64),
+    }
+    for name, frame in frames.items():
+        arrays[name] = frame.to_numpy(dtype=np.float64)
+        arrays[f"{name}_columns"] = np.asarray(frame.columns, dtype=str)
+    if stored.approximate:
+        arrays["members"] = stored.members
+
+    def write(temporary_path):
+        for name, array in arrays.items():
+            np.save(
+                os.path.join(temporary_path, f"{name}.npy"), array, allow_pickle=False
+            )
+
+    try:
+        atomic_write(path, write, directory=True)
+    except ValueError:
+        # labels of mixed types cannot be saved without pickling
+        return False
+    except OSError:
+        # another process saved the dataset first
+        return os.path.isdir(path)
+
+    register_dataset(stored.key, sum(array.nbytes for array in arrays.values()))
+    remove_datasets(evict(keep=stored.key), folder)
+    return True
+
+
+def remove_datasets(keys: list[str], folder: str = DATASET_FOLDER) -> None:
+    """
+    Deletes saved datasets. Processes that have them memory-mapped keep reading
+    them until they drop them.
+    """
+    for key in keys:
+        _DATASET_CACHE.pop(key)
+    for key in keys:
+        if _DATASET_KEY.match(key):
+            shutil.rmtree(os.path.join(folder, key), ignore_errors=True)
+
+
+def load_dataset(key: str, folder: str = DATASET_FOLDER) -> StoredDataset:
+    """
+    Opens a saved dataset as read-only memory maps, all processes opening it share
+    the same pages.
+    :raises DatasetNotFoundError: when the dataset is not saved
+    """
+    path = os.path.join(folder, key) if _DATASET_KEY.match(key or "") else None
+    if path is None or not os.path.isdir(path):
+        raise DatasetNotFoundError(key)
+
+    def array(name: str) -> np.ndarray:
+        return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+    def frame(name: str) -> pd.DataFrame:
+        columns = array(f"{name}_columns").tolist()
+        return pd.DataFrame(array(name), columns=columns, copy=False)
+
+    approximate = os.path.exists(os.path.join(path, "members.npy"))
+    return StoredDataset(
+        key,
+        frame("dataset"),
+        array("merge_matrix"),
+        array("labels").tolist(),
+        array("order").tolist(),
+        frame("points") if approximate else None,
+        array("members") if approximate else None,
+    )
+
+
+_DATASET_CACHE = LRUCache(DATASET_CACHE_SIZE)
+
+
+def put_dataset(
+    dataset: pd.DataFrame,
+    merge_matrix,
+    labels,
+    order,
+    points: pd.DataFrame | None = None,
+    members=None,
+) -> dict:
+    """
+    Saves the dataset for all server processes and keeps it in the in-process LRU
+    cache.
+    :param points: observations summarized by the rows of an approximate dataset
+    :param members: row of the dataset every observation belongs to
+    :return: handle of the dataset to be put in a dcc.Store
+    """
+    key = dataset_key(dataset, merge_matrix, labels, order, members)
+    cached = _DATASET_CACHE.get(key)
+    if cached is not None:
+        return cached.handle
+
+    stored = StoredDataset(key, dataset, merge_matrix, labels, order, points, members)
+    if save_dataset(stored):
+        # drop the private copy, the memory maps are shared with the other workers
+        stored = load_dataset(key)
+    # a concurrent request may have cached it in the meantime
+    return _DATASET_CACHE.put(key, stored).handle
+
+
+def get_dataset(handle: dict) -> StoredDataset:
+    """
+    Resolves a handle created by put_dataset in any server process. The returned
+    data are shared between callbacks and must not be modified.
+    :raises DatasetNotFoundError: when the dataset was evicted and is not saved
+    """
+    key = handle["key"] if handle else None
+    cached = _DATASET_CACHE.get(key)
+    if cached is None:
+        cached = _DATASET_CACHE.put(key, load_dataset(key))
+    touch_dataset(key)
+    return cached
+
+
+def dataset_available(handle: dict) -> bool:
+    """
+    Whether get_dataset can resolve the handle, without marking the dataset as
+    used.
+    """
+    key = handle["key"] if handle else None
+    if _DATASET_CACHE.get(key) is not None:
+        return True
+    return bool(_DATASET_KEY.match(key or "")) and os.path.isdir(
+        os.path.join(DATASET_FOLDER, key)
+    )
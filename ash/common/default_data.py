@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from common.atomic_files import atomic_write
+from common.data_parser import DATA_FOLDER, RDataParser
+from common.process_cache import ForkSafeLock
+
+SNAPSHOT_FOLDER = os.path.join(DATA_FOLDER, "snapshots")
+DEFAULT_SNAPSHOT = os.path.join(SNAPSHOT_FOLDER, "default.npz")
+# R exports the default dataset is parsed from
+DEFAULT_SOURCES = ["data.csv", "merge.csv", "heights.csv", "order.csv"]
+
+
+class DefaultData:
+    """
+    Dataset shown before anything is uploaded, with its clustering in scipy format.
+    """
+
+    def __init__(self, dataset: pd.DataFrame, merge_matrix, labels, order):
+        self.dataset = dataset
+        self.merge_matrix = merge_matrix
+        self.labels = labels
+        self.order = order
+
+
+def snapshot_is_current(snapshot: str = DEFAULT_SNAPSHOT) -> bool:
+    """
+    Whether the snapshot exists and is newer than all R exports.
+    """
+    try:
+        snapshot_time = os.path.getmtime(snapshot)
+    except FileNotFoundError:
+        return False
+    return all(
+        os.path.getmtime(os.path.join(DATA_FOLDER, source)) <= snapshot_time
+        for source in DEFAULT_SOURCES
+    )
+
+
+def write_snapshot(default: DefaultData, snapshot: str = DEFAULT_SNAPSHOT) -> None:
+    """
+    Saves the default dataset as a .npz file.
+    """
+    atomic_write(
+        snapshot,
+        lambda file: np.savez(
+            file,
+            data=default.dataset.to_numpy(dtype=np.float64),
+            columns=np.asarray(default.dataset.columns, dtype=str),
+            merge_matrix=default.merge_matrix,
+            labels=np.asarray(default.labels),
+            order=np.asarray(default.order, dtype=np.float64),
+        ),
+    )
+
+
+def read_snapshot(snapshot: str = DEFAULT_SNAPSHOT) -> DefaultData:
+    with np.load(snapshot, allow_pickle=False) as arrays:
+        return DefaultData(
+            pd.DataFrame(arrays["data"], columns=arrays["columns"].tolist()),
+            arrays["merge_matrix"],
+            arrays["labels"].tolist(),
+            arrays["order"].tolist(),
+        )
+
+
+def parse_default_data() -> DefaultData:
+    parser = RDataParser()
+    parser.parse()
+    return DefaultData(parser.dataset, parser.merge_matrix, parser.labels, parser.order)
+
+
+_DEFAULT_DATA = None
+_DEFAULT_DATA_LOCK = ForkSafeLock()
+
+
+def default_data() -> DefaultData:
+    """
+    Loads the default dataset on first use, from the binary snapshot when it is
+    current and otherwise from the R exports, writing the snapshot for the next
+    start. Nothing is read when the module is imported.
+    """
+    global _DEFAULT_DATA
+    with _DEFAULT_DATA_LOCK:
+        if _DEFAULT_DATA is None:
+            if snapshot_is_current():
+                _DEFAULT_DATA = read_snapshot()
+            else:
+                _DEFAULT_DATA = parse_default_data()
+                try:
+                    write_snapshot(_DEFAULT_DATA)
+                except OSError:
+                    # read-only deployment, parse the exports on every start
+                    pass
+        return _DEFAULT_DATA
+
+
+if __name__ == "__main__":
+    # precompute the snapshot, e.g. while building the image
+    write_snapshot(parse_default_data())
@@ -0,0 +1,163 @@
+import warnings
+
+import numpy as np
+
+from common.custom_threshold_plotly_dendrogram import (link_slot_trace,
+                                                       link_slots,
+                                                       node_marker_trace)
+from common.linkage_index import LinkageIndex
+
+# assumed width of the dendrogram plot, the graph size is not known on the server
+DENDROGRAM_PIXEL_WIDTH = 1600
+# subtrees narrower than this are collapsed into a single stub
+MIN_LINK_PIXELS = 2
+MAX_VISIBLE_LINKS = 20_000
+# aggregation of the leaves falling into one column of the heatmap
+HEATMAP_AGGREGATIONS = {"Mean": np.nanmean, "Median": np.nanmedian, "Max": np.nanmax}
+# the heatmap shares the x axis of the dendrogram
+DENDROGRAM_X_AXES = ("xaxis", "xaxis2")
+
+
+def dendrogram_x_range(relayout_data) -> tuple[float, float] | None:
+    """
+    X axis range of the dendrogram after zooming, None for the whole dendrogram.
+    """
+    if not relayout_data:
+        return None
+    for axis in DENDROGRAM_X_AXES:
+        if relayout_data.get(f"{axis}.autorange"):
+            return None
+        if f"{axis}.range[0]" in relayout_data:
+            return relayout_data[f"{axis}.range[0]"], relayout_data[f"{axis}.range[1]"]
+        if f"{axis}.range" in relayout_data:
+            return tuple(relayout_data[f"{axis}.range"])
+    return None
+
+
+def heatmap_bins(
+    values: np.ndarray,
+    x_range: tuple[float, float] | None = None,
+    aggregation: str = "Mean",
+    pixel_width: int = DENDROGRAM_PIXEL_WIDTH,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Aggregates the leaves within an x range of the dendrogram into at most one
+    heatmap column per pixel, so the size of the heatmap is bounded by the screen
+    resolution and not by the number of leaves. Consecutive leaves are binned,
+    a range of at most pixel_width leaves keeps one column per leaf.
+    :param values: matrix of features x leaves in the left-to-right leaf order
+    :param aggregation: one of HEATMAP_AGGREGATIONS, missing values are ignored
+    :return: tuple (edges of the columns in dendrogram x coordinates, matrix of
+        features x columns)
+    """
+    nr_leaves = values.shape[1]
+    low, high = sorted(x_range) if x_range else (0.0, 10.0 * nr_leaves)
+    # leaves are 10 apart, leaf i spans [10 * i, 10 * (i + 1))
+    first = int(np.clip(np.floor(low / 10), 0, nr_leaves))
+    last = int(np.clip(np.ceil(high / 10), first, nr_leaves))
+    nr_bins = min(last - first, pixel_width)
+    if nr_bins == 0:
+        return np.empty(0), np.empty((len(values), 0))
+
+    # bins are at least one leaf wide, so the floored edges are distinct
+    edges = np.floor(np.linspace(first, last, nr_bins + 1)).astype(np.int64)
+    columns = edges[:-1, np.newaxis] + np.arange(np.diff(edges).max())
+    padding = columns >= edges[1:, np.newaxis]
+    binned = values[:, np.minimum(columns, last - 1)].astype(np.float64)
+    binned[:, padding] = np.nan
+    with warnings.catch_warnings():
+        # bins holding only missing values stay empty
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return 10.0 * edges, HEATMAP_AGGREGATIONS[aggregation](binned, axis=2)
+
+
+class DendrogramView:
+    """
+    Links of a dendrogram worth drawing within an x range. Links are addressed by
+    their position in the node order (node number = nr_links - position).
+    A link narrower than MIN_LINK_PIXELS is not drawn, the topmost of such links
+    is drawn as a stub summarizing its subtree. The threshold is raised until at
+    most MAX_VISIBLE_LINKS links are drawn, so the size of the figure is bounded
+    by the screen resolution and not by the number of leaves.
+    """
+
+    def __init__(
+        self,
+        index: LinkageIndex,
+        x_range: tuple[float, float] | None = None,
+        pixel_width: int = DENDROGRAM_PIXEL_WIDTH,
+        min_link_pixels: float = MIN_LINK_PIXELS,
+        max_links: int = MAX_VISIBLE_LINKS,
+    ):
+        self.index = index
+        self.icoord, self.dcoord = index.link_coordinates()
+
+        nodes = index.nr_points + index.sorted_rows
+        # leaves are 10 apart, a subtree spans [10 * start, 10 * end)
+        left = 10.0 * index.start[nodes]
+        right = 10.0 * index.end[nodes]
+        parents = index.parent[nodes]
+        width = right - left
+        parent_width = np.where(
+            parents >= 0, 10.0 * index.size[np.maximum(parents, 0)], np.inf
+        )
+
+        low, high = sorted(x_range) if x_range else (0.0, 10.0 * index.nr_points)
+        in_view = (right >= low) & (left <= high)
+        # a range narrower than one leaf still gives a threshold that can grow
+        threshold = min_link_pixels * max(high - low, 10.0) / pixel_width
+        while True:
+            expanded = width >= threshold
+            drawn = in_view & expanded
+            if np.count_nonzero(drawn) <= max_links:
+                break
+            threshold *= 2
+        stubs = in_view & ~expanded & (parent_width >= threshold)
+
+        self.drawn = np.flatnonzero(drawn)
+        self.stubs = np.flatnonzero(stubs)
+        # a stub is a triangle from the subtree leaves up to the link
+        middle = (self.icoord[self.stubs, 1] + self.icoord[self.stubs, 2]) / 2
+        height = self.dcoord[self.stubs, 1]
+        self.stub_x = np.column_stack(
+            [left[self.stubs] + 5, middle, right[self.stubs] - 5]
+        )
+        self.stub_y = np.column_stack(
+            [np.zeros(len(height)), height, np.zeros(len(height))]
+        )
+        self.stub_sizes = index.size[nodes[self.stubs]]
+
+    def traces(self, colors, monocrit_list: list[int], palette) -> list[dict]:
+        """
+        Consolidated traces of the visible links: one line trace per color followed by
+        the marker trace of the link midpoints.
+        :param colors: colors of all links in the node order
+        """
+        colors = np.asarray(colors, dtype=object)
+        traces = []
+        for color in link_slots(palette):
+            drawn = self.drawn[colors[self.drawn] == color]
+            stubs = colors[self.stubs] == color
+            trace = link_slot_trace(self.icoord[drawn], self.dcoord[drawn], color)
+            stub_trace = link_slot_trace(self.stub_x[stubs], self.stub_y[stubs], color)
+            trace["x"] = np.concatenate([trace["x"], stub_trace["x"]])
+            trace["y"] = np.concatenate([trace["y"], stub_trace["y"]])
+            traces.append(trace)
+
+        positions = np.concatenate([self.drawn, self.stubs])
+        node_numbers = self.index.nr_links - positions
+        markers = node_marker_trace(
+            self.icoord[positions],
+            self.dcoord[positions],
+            colors[positions],
+            node_numbers,
+            monocrit_list,
+        )
+        markers["hovertext"][len(self.drawn) :] = [
+            f"Node {node} ({size} leaves)"
+            for node, size in zip(
+                node_numbers[len(self.drawn) :].tolist(), self.stub_sizes.tolist()
+            )
+        ]
+        traces.append(markers)
+        return traces
@@ -0,0 +1,101 @@
+import contextlib
+import fcntl
+import hashlib
+import os
+import time
+
+import diskcache
+from dash import DiskcacheManager
+
+JOBS_FOLDER = os.path.join(os.getcwd(), "common", "user_data", "jobs")
+# background jobs computing at the same time in all server processes, every job
+# runs in its own process
+MAX_RUNNING_JOBS = max(1, (os.cpu_count() or 2) // 2)
+# jobs waiting for a free slot, further ones are refused
+MAX_WAITING_JOBS = 8
+SLOT_POLL_SECONDS = 1.0
+
+
+class JobQueueFullError(RuntimeError):
+    pass
+
+
+def background_callback_manager() -> DiskcacheManager:
+    """
+    Runs background callbacks in their own processes, their progress and results
+    are exchanged through a disk cache shared by all server workers.
+    """
+    return DiskcacheManager(diskcache.Cache(os.path.join(JOBS_FOLDER, "cache")))
+
+
+def job_key(*parts) -> str:
+    """
+    Key of a computation, e.g. dataset hash, operation and parameters.
+    """
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+@contextlib.contextmanager
+def single_flight(key: str):
+    """
+    Lets only one thread or process at a time run the block for the key, others
+    wait for it to finish. Combined with a check of the result store before and
+    inside the block, identical requests are computed only once.
+    """
+    folder = os.path.join(JOBS_FOLDER, "locks")
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, f"{key}.lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _try_lock_any(folder: str, count: int):
+    """
+    Locks the first free of count lock files in the folder without waiting.
+    :return: the open locked file, None when all are locked
+    """
+    os.makedirs(folder, exist_ok=True)
+    for slot in range(count):
+        lock_file = open(os.path.join(folder, f"{slot}.lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return lock_file
+        except BlockingIOError:
+            lock_file.close()
+    return None
+
+
+@contextlib.contextmanager
+def job_slot(
+    kind: str,
+    running: int = MAX_RUNNING_JOBS,
+    waiting: int = MAX_WAITING_JOBS,
+    on_wait=None,
+):
+    """
+    Runs the block once one of the running slots of the kind of job is free in all
+    server processes. The locks are released by the system when a job process is
+    terminated, e.g. a cancelled one.
+    :param on_wait: called while the job waits for a slot
+    :raises JobQueueFullError: when running + waiting jobs hold or wait for a slot
+    """
+    folder = os.path.join(JOBS_FOLDER, "slots", kind)
+    ticket = _try_lock_any(os.path.join(folder, "queue"), running + waiting)
+    if ticket is None:
+        raise JobQueueFullError(f"Too many {kind} jobs, try again later")
+    try:
+        slot = _try_lock_any(os.path.join(folder, "running"), running)
+        while slot is None:
+            if on_wait is not None:
+                on_wait()
+            time.sleep(SLOT_POLL_SECONDS)
+            slot = _try_lock_any(os.path.join(folder, "running"), running)
+        try:
+            yield
+        finally:
+            slot.close()
+    finally:
+        ticket.close()
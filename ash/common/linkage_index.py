@@ -0,0 +1,179 @@
+import hashlib
+
+import numpy as np
+
+from common.process_cache import ForkSafeLock, LRUCache
+
+LINKAGE_INDEX_CACHE_SIZE = 16
+
+
+def linkage_key(linkage) -> str:
+    """
+    Content hash of a linkage matrix. Only the tree structure and the joining heights
+    are hashed, those are the only columns the index depends on.
+    """
+    matrix = np.ascontiguousarray(np.asarray(linkage, dtype=np.float64)[:, :3])
+    digest = hashlib.sha1(str(matrix.shape).encode())
+    digest.update(matrix.tobytes())
+    return digest.hexdigest()
+
+
+def leaf_intervals(left, right):
+    """
+    Computes the subtree sizes and the [start, end) interval of leaf positions covered
+    by every node. Every subtree covers a contiguous block of the leaf order, so the
+    leaves under a node are simply leaf_order[start[node]:end[node]].
+    Nodes are numbered as in scipy: points are 0..n-1, linkage row i is node n + i.
+    The intervals are computed iteratively in O(n), so deep (chained) trees do not
+    hit the recursion limit.
+    :param left: left child of every linkage row
+    :param right: right child of every linkage row
+    :return: tuple (size, start, end) of integer arrays indexed by node
+    """
+    children = list(zip(left.tolist(), right.tolist()))
+    nr_points = len(children) + 1
+
+    sizes = [1] * nr_points + [0] * len(children)
+    for row, (left_child, right_child) in enumerate(children):
+        sizes[nr_points + row] = sizes[left_child] + sizes[right_child]
+
+    # the root is formed by the last row, left child is placed before the right one
+    start = [0] * len(sizes)
+    for row in range(len(children) - 1, -1, -1):
+        left_child, right_child = children[row]
+        start[left_child] = start[nr_points + row]
+        start[right_child] = start[nr_points + row] + sizes[left_child]
+
+    size = np.array(sizes, dtype=np.int64)
+    start = np.array(start, dtype=np.int64)
+    return size, start, start + size
+
+
+class LinkageIndex:
+    """
+    Precomputed tree facts for one linkage matrix. All arrays are indexed by scipy
+    node id (points are 0..n-1, linkage row i is node n + i) unless stated otherwise.
+
+    Node numbers displayed in the dendrogram ("Node 1" is the root) follow the order
+    of the links sorted by height, node_to_row and row_to_node translate between
+    the two numberings.
+    """
+
+    def __init__(self, linkage):
+        linkage = np.asarray(linkage, dtype=np.float64)
+        self.key = linkage_key(linkage)
+        self.nr_links = linkage.shape[0]
+        self.nr_points = self.nr_links + 1
+        rows = np.arange(self.nr_links)
+
+        # per linkage row
+        self.left = linkage[:, 0].astype(np.int64)
+        self.right = linkage[:, 1].astype(np.int64)
+        self.heights = linkage[:, 2].copy()
+
+        # per node
+        self.size, self.start, self.end = leaf_intervals(self.left, self.right)
+        self.parent = np.full(self.nr_points + self.nr_links, -1, dtype=np.int64)
+        self.parent[self.left] = self.nr_points + rows
+        self.parent[self.right] = self.nr_points + rows
+
+        # leaf position <-> point
+        self.leaf_position = self.start[: self.nr_points].copy()
+        self.leaf_order = np.empty(self.nr_points, dtype=np.int64)
+        self.leaf_order[self.leaf_position] = np.arange(self.nr_points)
+
+        # links are drawn in post-order (left, right, node), in post-order a subtree
+        # ends before the next one does and descendants sharing the end are smaller
+        link_start = self.start[self.nr_points :]
+        link_end = self.end[self.nr_points :]
+        link_size = self.size[self.nr_points :]
+        self.postorder = np.lexsort((link_size, link_end))
+        # subtree of a row is a contiguous block of the pre-order
+        self.preorder = np.lexsort((-link_size, link_start))
+        self.preorder_position = np.empty(self.nr_links, dtype=np.int64)
+        self.preorder_position[self.preorder] = rows
+
+        # links are numbered from the top after a stable sort by their drawn height
+        node_heights = np.concatenate([np.zeros(self.nr_points), self.heights])
+        drawn_heights = np.maximum(
+            self.heights,
+            np.maximum(node_heights[self.left], node_heights[self.right]),
+        )
+        self.sorted_rows = self.postorder[
+            np.argsort(drawn_heights[self.postorder], kind="stable")
+        ]
+        self.row_to_node = np.empty(self.nr_links, dtype=np.int64)
+        self.row_to_node[self.sorted_rows] = self.nr_links - rows
+        self.node_to_row = np.full(self.nr_links + 1, -1, dtype=np.int64)
+        self.node_to_row[self.row_to_node] = rows
+
+        self._link_coordinates = None
+        self._link_coordinates_lock = ForkSafeLock()
+
+    def node_id(self, node_number: int) -> int:
+        """
+        Scipy node id of the link displayed as "Node <node_number>".
+        """
+        return self.nr_points + int(self.node_to_row[int(node_number)])
+
+    def interval(self, node_number: int) -> tuple[int, int]:
+        """
+        [start, end) leaf positions under the link displayed as "Node <node_number>".
+        """
+        node = self.node_id(node_number)
+        return int(self.start[node]), int(self.end[node])
+
+    def leaves(self, node_number: int) -> np.ndarray:
+        """
+        Points under the link displayed as "Node <node_number>".
+        """
+        start, end = self.interval(node_number)
+        return self.leaf_order[start:end]
+
+    def subtree_rows(self, row: int) -> np.ndarray:
+        """
+        Linkage rows of the subtree rooted in the given row, the row included.
+        """
+        position = self.preorder_position[row]
+        return self.preorder[position : position + self.size[self.nr_points + row] - 1]
+
+    def link_coordinates(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Coordinates of the '∩' shapes of all links ordered by node number from the
+        bottom of the dendrogram, the same layout scipy uses: leaves are 10 apart
+        starting at 5 and every link sits in the middle of its children.
+        :return: tuple (icoord, dcoord) of (nr_links, 4) arrays
+        """
+        with self._link_coordinates_lock:
+            if self._link_coordinates is None:
+                self._link_coordinates = self._build_link_coordinates()
+        return self._link_coordinates
+
+    def _build_link_coordinates(self) -> tuple[np.ndarray, np.ndarray]:
+        x = (5 + 10 * self.leaf_position).tolist() + [0.0] * self.nr_links
+        for row, (left, right) in enumerate(
+            zip(self.left.tolist(), self.right.tolist())
+        ):
+            x[self.nr_points + row] = (x[left] + x[right]) / 2
+        x = np.array(x, dtype=np.float64)
+        y = np.concatenate([np.zeros(self.nr_points), self.heights])
+
+        rows = self.sorted_rows
+        left, right = self.left[rows], self.right[rows]
+        icoord = np.column_stack([x[left], x[left], x[right], x[right]])
+        height = self.heights[rows]
+        dcoord = np.column_stack([y[left], height, height, y[right]])
+        return icoord, dcoord
+
+
+_INDEX_CACHE = LRUCache(LINKAGE_INDEX_CACHE_SIZE)
+
+
+def get_linkage_index(linkage) -> LinkageIndex:
+    """
+    Returns the LinkageIndex of a linkage matrix, built once per matrix content
+    and kept in a small in-process LRU cache.
+    """
+    return _INDEX_CACHE.get_or_build(
+        linkage_key(linkage), lambda: LinkageIndex(linkage)
+    )
@@ -1,38 +1,157 @@
+import hashlib
+import importlib
+import json
 import os
 
 import numpy
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
-from sklearn.decomposition import PCA
-from sklearn.manifold import TSNE
-from umap import UMAP
+
+from common.atomic_files import atomic_write
+from common.dataset_store import StoredDataset
+from common.jobs import job_slot, single_flight
+from common.linkage_index import LinkageIndex
 
 DATA_FOLDER = os.path.join(os.getcwd(), "common", "user_data")
 
 REDUCED_DIMENSIONS_FOLDER = "reduced_dimensions"
 
-numpy.set_printoptions(threshold=9999999999999)
+# the reductions are imported on first use, importing umap compiles its numba code
+REDUCTIONS = {
+    "PCA": ("sklearn.decomposition", "PCA"),
+    "tSNE": ("sklearn.manifold", "TSNE"),
+    "UMAP": ("umap", "UMAP"),
+}
+# parameters of the reductions besides the number of components, part of the key
+# of a stored embedding
+REDUCTION_PARAMETERS = {
+    "PCA": {},
+    "tSNE": {"random_state": 0, "perplexity": 5},
+    "UMAP": {"init": "random", "random_state": 0},
+}
+
+
+def reduction_class(method: str):
+    """
+    Estimator class of one of the REDUCTIONS.
+    """
+    module, name = REDUCTIONS[method]
+    return getattr(importlib.import_module(module), name)
+
+
+def features_key(feature_matrix) -> str:
+    """
+    Content hash of a feature matrix.
+    """
+    matrix = numpy.ascontiguousarray(feature_matrix, dtype=numpy.float64)
+    digest = hashlib.sha1(str(matrix.shape).encode())
+    digest.update(matrix.tobytes())
+    return digest.hexdigest()
+
+
+def reduction_filename(
+    data_key: str, method: str, dimensions: int, parameters: dict
+) -> str:
+    """
+    File name of a stored embedding, unique for the data, the method, the number
+    of dimensions and the parameters of the method.
+    """
+    digest = hashlib.sha1(data_key.encode())
+    digest.update(json.dumps(parameters, sort_keys=True).encode())
+    return f"{method}_{dimensions}d_{digest.hexdigest()}.npy"
 
 
 class PlotMaster:
     def __init__(
-        self, input_data, labels: list[str], order: list[int | float], color_map: dict
+        self,
+        input_data,
+        labels: list[str],
+        order: list[int | float],
+        color_map: dict,
+        linkage_index: LinkageIndex | None = None,
+        artifacts: StoredDataset | None = None,
+        progress=None,
     ):
         self.input_data = input_data
         self.labels = labels
         self.order = order
         self.color_map = color_map
+        self.linkage_index = linkage_index
+        # shared artifacts derived from input_data, built once per dataset
+        self.artifacts = artifacts
+        # called with a message at every stage of a dimensionality reduction
+        self.progress = progress or (lambda message: None)
 
     def plot_dendrogram(self, dendrogram):
         return go.Figure(data=dendrogram.data, layout=dendrogram.layout)
 
+    def leaf_order(self) -> list[int]:
+        if self.linkage_index is not None:
+            return self.linkage_index.leaf_order
+        return [int(index) for index in self.order]
+
     def order_labels(self):
         ordered_labels = []
-        for index in self.order:
+        for index in self.leaf_order():
             ordered_labels.append(self.labels[int(index)])
         return ordered_labels
 
+    def ordered_input_data(self) -> pd.DataFrame:
+        """
+        Input data with rows in the left-to-right order of the dendrogram leaves.
+        """
+        if self.artifacts is not None:
+            return self.artifacts.ordered_dataset
+        return self.input_data.iloc[self.leaf_order()]
+
+    def feature_matrix(self):
+        """
+        Input data as a float matrix for the dimensionality reductions.
+        """
+        if self.artifacts is not None:
+            return self.artifacts.feature_matrix
+        return self.input_data.to_numpy(dtype=float)
+
+    def features_key(self) -> str:
+        if self.artifacts is not None:
+            return self.artifacts.artifact(
+                "features_key", lambda: features_key(self.artifacts.feature_matrix)
+            )
+        return features_key(self.feature_matrix())
+
+    def reduce_dimensions(self, method: str, dimensions: int):
+        """
+        Embedding of the input data by one of the REDUCTIONS. Embeddings are kept
+        in the embedding store, so each one is computed only once for given data.
+        At most MAX_RUNNING_JOBS embeddings are computed at the same time.
+        :raises JobQueueFullError: when too many embeddings wait to be computed
+        """
+        self.progress("Loading the data")
+        parameters = REDUCTION_PARAMETERS[method]
+        filename = reduction_filename(
+            self.features_key(), method, dimensions, parameters
+        )
+        embedding = self.read_reduction(filename, REDUCED_DIMENSIONS_FOLDER)
+        if embedding is None:
+            # concurrent requests for the same embedding wait for the first one
+            with single_flight(filename):
+                embedding = self.read_reduction(filename, REDUCED_DIMENSIONS_FOLDER)
+                if embedding is None:
+                    embedding = self._compute_reduction(method, dimensions, filename)
+        self.progress("Drawing the plot")
+        return embedding
+
+    def _compute_reduction(self, method: str, dimensions: int, filename: str):
+        waiting = "Waiting for one of the running reductions to finish"
+        with job_slot("reduction", on_wait=lambda: self.progress(waiting)):
+            self.progress(f"Computing the {method} embedding")
+            embedding = reduction_class(method)(
+                n_components=dimensions, **REDUCTION_PARAMETERS[method]
+            ).fit_transform(self.feature_matrix())
+        self.progress(f"Saving the {method} embedding")
+        self.save_reduction(embedding, filename, REDUCED_DIMENSIONS_FOLDER)
+        return embedding
+
     def df_to_plotly(
         self,
         df: pd.DataFrame,
@@ -41,32 +160,44 @@ class PlotMaster:
         df = df[desired_columns].T
         return {"z": df.values, "y": df.index.tolist()}
 
-    def plot_all_dimensions(self):
-        features = self.input_data.columns
-        fig = px.scatter_matrix(
-            self.input_data,
-            dimensions=features,
-            color=list(self.color_map.keys()),
-            color_discrete_map=self.color_map,
-            hover_name=self.labels,
+    def plot_all_dimensions(self, color_map):
+        """
+        Scatter matrix of all features in a single trace, colored like the
+        embeddings so that a change of the clusters only replaces its colors.
+        """
+        fig = go.Figure(
+            go.Splom(
+                dimensions=[
+                    {"label": feature, "values": self.input_data[feature]}
+                    for feature in self.input_data.columns
+                ],
+                marker={"color": color_map},
+                hovertext=self.labels,
+                diagonal_visible=True,
+            )
         )
-        fig.update_traces(diagonal_visible=True)
+        fig.update_layout({"showlegend": False})
         return fig
 
-    def plot_pca(self, color_map, dimensions: int = 2):
-        pca = PCA(dimensions).fit_transform(self.input_data)
-
-        if dimensions == 2:
-            fig = px.scatter(
-                pca,
-                x=0,
-                y=1,
-                title="First and Second Principal Components",
-                color=color_map,
-                color_discrete_map={c: c for c in color_map},
+    @staticmethod
+    def plot_embedding(embedding, color_map, title: str):
+        """
+        Scatter plot of a 2D or 3D embedding in a single trace, the colors of the
+        points are one array so that a change of the clusters only replaces
+        data[0].marker.color.
+        """
+        if embedding.shape[1] == 2:
+            fig = go.Figure(
+                go.Scatter(
+                    x=embedding[:, 0],
+                    y=embedding[:, 1],
+                    mode="markers",
+                    marker={"color": color_map},
+                )
             )
             fig.update_layout(
                 {
+                    "title": title,
                     "xaxis_title": "1st Component",
                     "yaxis_title": "2nd Component",
                     "showlegend": False,
@@ -82,17 +213,18 @@ class PlotMaster:
                 name="",
             )
         else:
-            fig = px.scatter_3d(
-                pca,
-                x=0,
-                y=1,
-                z=2,
-                color=color_map,
-                color_discrete_map={c: c for c in color_map},
-                title="First Three Principal Components",
+            fig = go.Figure(
+                go.Scatter3d(
+                    x=embedding[:, 0],
+                    y=embedding[:, 1],
+                    z=embedding[:, 2],
+                    mode="markers",
+                    marker={"color": color_map},
+                )
             )
             fig.update_layout(
                 {
+                    "title": title,
                     "showlegend": False,
                     "scene": {
                         "xaxis_title": "1st Component",
@@ -113,129 +245,32 @@ class PlotMaster:
             )
         return fig
 
-    def plot_tsne(self, color_map, dimensions: int = 2):
-        tsne = TSNE(
-            n_components=dimensions, random_state=0, perplexity=5
-        ).fit_transform(self.input_data)
+    def plot_pca(self, color_map, dimensions: int = 2):
+        if dimensions == 2:
+            title = "First and Second Principal Components"
+        else:
+            title = "First Three Principal Components"
+        return self.plot_embedding(
+            self.reduce_dimensions("PCA", dimensions), color_map, title
+        )
 
+    def plot_tsne(self, color_map, dimensions: int = 2):
         if dimensions == 2:
-            fig = px.scatter(
-                tsne,
-                x=0,
-                y=1,
-                title="t-distributed Stochastic Neighbor Embedding (t-SNE) - First Two Components",
-                color=color_map,
-                color_discrete_map={c: c for c in color_map},
-            )
-            fig.update_layout(
-                {
-                    "xaxis_title": "1st Component",
-                    "yaxis_title": "2nd Component",
-                    "showlegend": False,
-                }
-            )
-            fig.update_traces(
-                hovertemplate="<br>".join(
-                    [
-                        "1st Component: %{x}",
-                        "2nd Component: %{y}",
-                    ]
-                ),
-                name="",
-            )
+            title = "t-distributed Stochastic Neighbor Embedding (t-SNE) - First Two Components"
         else:
-            fig = px.scatter_3d(
-                tsne,
-                x=0,
-                y=1,
-                z=2,
-                color=color_map,
-                color_discrete_map={c: c for c in color_map},
-                title="t-distributed Stochastic Neighbor Embedding (t-SNE) - First Three Components",
-            )
-            fig.update_layout(
-                {
-                    "showlegend": False,
-                    "scene": {
-                        "xaxis_title": "1st Component",
-                        "yaxis_title": "2nd Component",
-                        "zaxis_title": "3rd Component",
-                    },
-                }
-            )
-            fig.update_traces(
-                hovertemplate="<br>".join(
-                    [
-                        "1st Component: %{x}",
-                        "2nd Component: %{y}",
-                        "3rd Component: %{z}",
-                    ]
-                ),
-                name="",
-            )
-        return fig
+            title = "t-distributed Stochastic Neighbor Embedding (t-SNE) - First Three Components"
+        return self.plot_embedding(
+            self.reduce_dimensions("tSNE", dimensions), color_map, title
+        )
 
     def plot_umap(self, color_map, dimensions: int = 2):
-        umap = UMAP(
-            n_components=dimensions, init="random", random_state=0
-        ).fit_transform(self.input_data)
-
         if dimensions == 2:
-            fig = px.scatter(
-                umap,
-                x=0,
-                y=1,
-                title="Uniform Manifold Approximation and Projection (UMAP) - First Two Components",
-                color=color_map,
-                color_discrete_map={c: c for c in color_map},
-            )
-            fig.update_layout(
-                {
-                    "xaxis_title": "1st Component",
-                    "yaxis_title": "2nd Component",
-                    "showlegend": False,
-                }
-            )
-            fig.update_traces(
-                hovertemplate="<br>".join(
-                    [
-                        "1st Component: %{x}",
-                        "2nd Component: %{y}",
-                    ]
-                ),
-                name="",
-            )
+            title = "Uniform Manifold Approximation and Projection (UMAP) - First Two Components"
         else:
-            fig = px.scatter_3d(
-                umap,
-                x=0,
-                y=1,
-                z=2,
-                color=color_map,
-                color_discrete_map={c: c for c in color_map},
-                title="Uniform Manifold Approximation and Projection (UMAP) - First Three Components",
-            )
-            fig.update_layout(
-                {
-                    "showlegend": False,
-                    "scene": {
-                        "xaxis_title": "1st Component",
-                        "yaxis_title": "2nd Component",
-                        "zaxis_title": "3rd Component",
-                    },
-                }
-            )
-            fig.update_traces(
-                hovertemplate="<br>".join(
-                    [
-                        "1st Component: %{x}",
-                        "2nd Component: %{y}",
-                        "3rd Component: %{z}",
-                    ]
-                ),
-                name="",
-            )
-        return fig
+            title = "Uniform Manifold Approximation and Projection (UMAP) - First Three Components"
+        return self.plot_embedding(
+            self.reduce_dimensions("UMAP", dimensions), color_map, title
+        )
 
     def plot_selected_features(self, desired_columns, color_mask):
         to_plot = self.input_data[desired_columns]
@@ -255,27 +290,27 @@ class PlotMaster:
     def save_reduction(
         data, filename: str, subfolder: str, path_to_folder: str = DATA_FOLDER
     ) -> None:
-        with open(os.path.join(path_to_folder, subfolder, filename), "w") as file:
-            file.write(str(data))
+        """
+        Saves an embedding as a .npy file.
+        """
+        atomic_write(
+            os.path.join(path_to_folder, subfolder, filename),
+            lambda file: numpy.save(file, numpy.asarray(data, dtype=numpy.float64)),
+        )
 
     @staticmethod
     def read_reduction(
         filename: str, subfolder: str, path_to_folder: str = DATA_FOLDER
-    ) -> list[list[float]] | None:
-        data = []
+    ) -> numpy.ndarray | None:
+        """
+        Memory-maps a saved embedding, None when it has not been saved yet.
+        """
         try:
-            with open(os.path.join(path_to_folder, subfolder, filename), "r") as file:
-                for line in file.readlines():
-                    row = list(
-                        map(
-                            float,
-                            line.strip().replace("[", "").replace("]", "").split(),
-                        )
-                    )
-                    data.append(row)
+            return numpy.load(
+                os.path.join(path_to_folder, subfolder, filename), mmap_mode="r"
+            )
         except FileNotFoundError:
             return None
-        return data
 
     @staticmethod
     def update_marker_color(fig, trace_index, new_color):
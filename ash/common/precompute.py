@@ -0,0 +1,72 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from common.dataset_store import StoredDataset
+from common.plot_master import PlotMaster
+
+PRECOMPUTE_WORKERS = 4
+
+READY = "ready"
+RUNNING = "running"
+FAILED = "failed"
+
+# threads and not processes, the artifacts have to end up in the memory of the
+# process serving the dataset; numpy, pandas and scikit-learn release the GIL
+# for the heavy parts
+_EXECUTOR = ThreadPoolExecutor(
+    max_workers=PRECOMPUTE_WORKERS, thread_name_prefix="precompute"
+)
+
+
+def _default_pca(stored: StoredDataset):
+    plot_master = PlotMaster(
+        stored.dataset,
+        stored.labels,
+        stored.order,
+        {},
+        linkage_index=stored.linkage_index,
+        artifacts=stored,
+    )
+    return plot_master.reduce_dimensions("PCA", 2)
+
+
+def _tasks(stored: StoredDataset) -> dict:
+    return {
+        "Leaf index": lambda: stored.linkage_index,
+        "Dendrogram geometry": lambda: stored.linkage_index.link_coordinates(),
+        "Ordered dataset": lambda: stored.ordered_dataset,
+        "Feature matrix": lambda: stored.feature_matrix,
+        "PCA": lambda: _default_pca(stored),
+    }
+
+
+def precompute_artifacts(stored: StoredDataset) -> dict[str, Future]:
+    """
+    Starts building the artifacts of a freshly uploaded dataset in parallel, so
+    that the first plots find them ready. Started only once per dataset.
+    :return: futures of the artifacts by their displayed name
+    """
+    return stored.artifact(
+        "precompute",
+        lambda: {
+            name: _EXECUTOR.submit(build) for name, build in _tasks(stored).items()
+        },
+    )
+
+
+def artifact_readiness(stored: StoredDataset) -> dict[str, str]:
+    """
+    READY, RUNNING or FAILED for every precomputed artifact of the dataset. Only
+    a precompute started in this process is reported, asking never starts one,
+    otherwise every server process answering a poll would build the artifacts.
+    """
+    if not stored.has_artifact("precompute"):
+        return {}
+    readiness = {}
+    for name, future in stored.artifact("precompute", dict).items():
+        if not future.done():
+            readiness[name] = RUNNING
+        elif future.exception() is not None:
+            readiness[name] = FAILED
+        else:
+            readiness[name] = READY
+    return readiness
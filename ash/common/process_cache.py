@@ -0,0 +1,121 @@
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+# objects that reset themselves in a forked child process
+_FORK_AWARE = weakref.WeakSet()
+
+
+def reset_after_fork(obj):
+    """
+    Calls obj.after_fork() in every child process forked from now on. Background
+    callbacks fork the server process, locks held by its threads would never be
+    released in the child and its threads do not exist there.
+    :return: the object
+    """
+    _FORK_AWARE.add(obj)
+    return obj
+
+
+def _after_fork_in_child():
+    for obj in list(_FORK_AWARE):
+        obj.after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class ForkSafeLock:
+    """
+    threading.Lock that is replaced by a released one in forked child processes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        reset_after_fork(self)
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        return self._lock.acquire(blocking, timeout)
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, *_):
+        self._lock.release()
+
+
+class LRUCache:
+    """
+    In-process cache keeping the size most recently used values, safe to use from
+    several threads and in forked child processes.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._values = OrderedDict()
+        self._lock = ForkSafeLock()
+        # one lock per key being built, so every value is built only once
+        self._build_locks = {}
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._values:
+                return default
+            self._values.move_to_end(key)
+            return self._values[key]
+
+    def put(self, key, value):
+        """
+        Caches the value unless the key is cached already.
+        :return: the cached value of the key
+        """
+        with self._lock:
+            if key in self._values:
+                self._values.move_to_end(key)
+                return self._values[key]
+            self._values[key] = value
+            while len(self._values) > self.size:
+                self._values.popitem(last=False)
+            return value
+
+    def get_or_build(self, key, build):
+        """
+        Returns the cached value of the key, calling build() when it is not cached.
+        Threads asking for the same key meanwhile wait for that build.
+        """
+        with self._lock:
+            if key in self._values:
+                self._values.move_to_end(key)
+                return self._values[key]
+            build_lock = self._build_locks.get(key)
+            if build_lock is None:
+                build_lock = self._build_locks[key] = ForkSafeLock()
+
+        with build_lock:
+            with self._lock:
+                if key in self._values:
+                    return self._values[key]
+            value = build()
+            with self._lock:
+                self._build_locks.pop(key, None)
+            return self.put(key, value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._values.pop(key, default)
+
+    def values(self) -> list:
+        with self._lock:
+            return list(self._values.values())
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
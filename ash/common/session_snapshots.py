@@ -0,0 +1,192 @@
+import logging
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from common.atomic_files import atomic_write
+from common.process_cache import reset_after_fork
+
+SESSION_SNAPSHOT_FOLDER = os.path.join(
+    os.getcwd(), "common", "user_data", "snapshots", "sessions"
+)
+# snapshots kept per session, the oldest ones are removed
+MAX_SNAPSHOTS = 20
+
+_SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+_SNAPSHOT_NAME = re.compile(r"^[0-9]{19}$")
+
+
+class SessionSnapshot:
+    """
+    What is needed to bring a session back: its dataset, the hash of the linkage
+    the split points refer to, the split points with their cluster ids and the
+    palette.
+    """
+
+    def __init__(
+        self,
+        dataset_key: str,
+        linkage_key: str,
+        split_points: list[int],
+        cluster_ids: list[int],
+        palette: str | None,
+    ):
+        self.dataset_key = dataset_key
+        self.linkage_key = linkage_key
+        self.split_points = [int(point) for point in split_points]
+        self.cluster_ids = [int(cluster_id) for cluster_id in cluster_ids]
+        self.palette = palette
+
+
+def snapshot_folder(session_id: str, folder: str = SESSION_SNAPSHOT_FOLDER) -> str:
+    if not _SESSION_ID.match(session_id or ""):
+        raise ValueError(f"Invalid session id {session_id}")
+    return os.path.join(folder, session_id)
+
+
+def snapshot_path(session_id: str, name: str) -> str:
+    if not _SNAPSHOT_NAME.match(name or ""):
+        raise ValueError(f"Invalid snapshot name {name}")
+    return os.path.join(snapshot_folder(session_id), f"{name}.npz")
+
+
+def _written_snapshots(session_id: str) -> list[str]:
+    try:
+        files = os.listdir(snapshot_folder(session_id))
+    except (OSError, ValueError):
+        return []
+    names = [name[: -len(".npz")] for name in files if name.endswith(".npz")]
+    return sorted(filter(_SNAPSHOT_NAME.match, names), reverse=True)
+
+
+def list_snapshots(session_id: str) -> list[str]:
+    """
+    Names of the snapshots of the session, the latest first. Snapshots still
+    waiting to be written are included.
+    """
+    names = set(_written_snapshots(session_id)) | set(_WRITER.unwritten(session_id))
+    return sorted(names, reverse=True)[:MAX_SNAPSHOTS]
+
+
+def snapshot_label(name: str) -> str:
+    """
+    Time the snapshot was saved at, as shown to the user.
+    """
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(int(name) / 1e9))
+
+
+def write_snapshot(session_id: str, name: str, snapshot: SessionSnapshot) -> None:
+    """
+    Adds the snapshot to the history of the session as a .npz file. Only the
+    MAX_SNAPSHOTS latest snapshots are kept.
+    """
+    atomic_write(
+        snapshot_path(session_id, name),
+        lambda file: np.savez(
+            file,
+            keys=np.array([snapshot.dataset_key, snapshot.linkage_key]),
+            split_points=np.array(snapshot.split_points, dtype=np.int64),
+            cluster_ids=np.array(snapshot.cluster_ids, dtype=np.int64),
+            palette=np.array([snapshot.palette or ""]),
+        ),
+    )
+    for old_name in _written_snapshots(session_id)[MAX_SNAPSHOTS:]:
+        try:
+            os.remove(snapshot_path(session_id, old_name))
+        except FileNotFoundError:
+            pass
+
+
+def read_snapshot(session_id: str, name: str) -> SessionSnapshot | None:
+    """
+    The snapshot of the session, None when there is none of this name.
+    """
+    unwritten = _WRITER.unwritten(session_id).get(name)
+    if unwritten is not None:
+        return unwritten
+    try:
+        with np.load(snapshot_path(session_id, name), allow_pickle=False) as arrays:
+            dataset_key, linkage_key = arrays["keys"].tolist()
+            return SessionSnapshot(
+                dataset_key,
+                linkage_key,
+                arrays["split_points"].tolist(),
+                arrays["cluster_ids"].tolist(),
+                arrays["palette"][0] or None,
+            )
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+class SnapshotWriter:
+    """
+    Writes snapshots from a background thread, so saving a snapshot does not
+    wait for the disk.
+    """
+
+    def __init__(self):
+        self.after_fork()
+        reset_after_fork(self)
+
+    def after_fork(self):
+        # the writer thread does not exist in a forked child, the parent writes
+        # the snapshots scheduled before the fork
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def schedule(self, session_id: str, name: str, snapshot: SessionSnapshot):
+        with self._condition:
+            self._pending[session_id, name] = snapshot
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="session-snapshots", daemon=True
+                )
+                self._thread.start()
+            self._condition.notify()
+
+    def unwritten(self, session_id: str) -> dict[str, SessionSnapshot]:
+        """
+        Snapshots of the session that are scheduled or being written, by name.
+        """
+        with self._condition:
+            return {
+                name: snapshot
+                for (session, name), snapshot in self._pending.items()
+                if session == session_id
+            }
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                (session_id, name), snapshot = next(iter(self._pending.items()))
+            try:
+                write_snapshot(session_id, name, snapshot)
+            except OSError:
+                logging.getLogger(__name__).exception(
+                    f"Error writing the snapshot of session {session_id}"
+                )
+            with self._condition:
+                # removed only once written, readers find it in one of the two places
+                del self._pending[session_id, name]
+
+
+_WRITER = SnapshotWriter()
+
+
+def schedule_snapshot(session_id: str, snapshot: SessionSnapshot) -> str:
+    """
+    Adds the snapshot to the history of the session, it is written in the
+    background.
+    :return: name of the snapshot, the time it was saved at in nanoseconds
+    :raises ValueError: for malformed session ids
+    """
+    name = str(time.time_ns())
+    snapshot_path(session_id, name)
+    _WRITER.schedule(session_id, name, snapshot)
+    return name
@@ -0,0 +1,210 @@
+import atexit
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from common.process_cache import reset_after_fork
+
+SESSION_DATABASE = os.path.join(os.getcwd(), "common", "user_data", "sessions.sqlite")
+# sessions and saved datasets not used for this long are removed
+STATE_TTL_SECONDS = 24 * 60 * 60
+# saved datasets beyond this size are removed, least recently used first
+DATASET_BYTES_LIMIT = 2 * 2**30
+# the last use of a dataset is recorded at most this often by one process
+TOUCH_INTERVAL_SECONDS = 60
+# session states scheduled within this time are written in one transaction
+SAVE_DELAY_SECONDS = 0.5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS datasets (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+"""
+
+_last_touched = {}
+
+
+@contextlib.contextmanager
+def _connect(database: str = SESSION_DATABASE):
+    """
+    Connection to the store shared by all server processes, the block runs in one
+    transaction. A connection is opened per use, so nothing is shared across forks.
+    """
+    os.makedirs(os.path.dirname(database), exist_ok=True)
+    connection = sqlite3.connect(database, timeout=30)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(_SCHEMA)
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def _save_sessions(states: dict[str, str]) -> None:
+    now = time.time()
+    with _connect() as connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+            [(session_id, state, now) for session_id, state in states.items()],
+        )
+
+
+class SessionWriter:
+    """
+    Saves session states from a background thread, so no interaction waits for
+    SQLite. The states scheduled within SAVE_DELAY_SECONDS are written in one
+    transaction, of the states of one session only the latest one.
+    """
+
+    def __init__(self):
+        self.after_fork()
+        reset_after_fork(self)
+
+    def after_fork(self):
+        # the writer thread does not exist in a forked child, the parent writes
+        # the states scheduled before the fork
+        self._pending = {}
+        self._writing = {}
+        self._condition = threading.Condition()
+        # flushes are written one after the other, so an older state never
+        # overwrites a newer one
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    def schedule(self, session_id: str, state: dict) -> None:
+        with self._condition:
+            self._pending[session_id] = json.dumps(state)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="session-writer", daemon=True
+                )
+                self._thread.start()
+            self._condition.notify()
+
+    def unsaved(self, session_id: str) -> dict | None:
+        """
+        State of the session that is not written yet, None when there is none.
+        """
+        with self._condition:
+            state = self._pending.get(session_id, self._writing.get(session_id))
+        return None if state is None else json.loads(state)
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._condition:
+                self._writing, self._pending = self._pending, {}
+            try:
+                if self._writing:
+                    _save_sessions(self._writing)
+            finally:
+                with self._condition:
+                    self._writing = {}
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+            time.sleep(SAVE_DELAY_SECONDS)
+            try:
+                self.flush()
+            except sqlite3.Error:
+                logging.getLogger(__name__).exception("Error saving the session states")
+
+
+_WRITER = SessionWriter()
+atexit.register(lambda: _WRITER.flush())
+
+
+def schedule_session_save(session_id: str, state: dict) -> None:
+    """
+    Saves the state of a browser session, e.g. its dataset handle and split points,
+    in the background, see SessionWriter.
+    """
+    _WRITER.schedule(session_id, state)
+
+
+def load_session(session_id: str) -> dict | None:
+    """
+    State saved for the session, None for unknown and expired sessions. When the
+    store cannot be read, e.g. it stays locked, the session starts empty.
+    """
+    unsaved = _WRITER.unsaved(session_id)
+    if unsaved is not None:
+        return unsaved
+    try:
+        with _connect() as connection:
+            row = connection.execute(
+                "SELECT state FROM sessions WHERE session_id = ? AND last_used > ?",
+                (session_id, time.time() - STATE_TTL_SECONDS),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE sessions SET last_used = ? WHERE session_id = ?",
+                (time.time(), session_id),
+            )
+    except sqlite3.OperationalError:
+        logging.getLogger(__name__).exception(
+            f"Error loading the state of session {session_id}"
+        )
+        return None
+    return json.loads(row[0])
+
+
+def register_dataset(key: str, size: int) -> None:
+    with _connect() as connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO datasets VALUES (?, ?, ?)", (key, size, time.time())
+        )
+    _last_touched[key] = time.monotonic()
+
+
+def touch_dataset(key: str) -> None:
+    """
+    Records a use of a saved dataset for the LRU eviction.
+    """
+    now = time.monotonic()
+    if now - _last_touched.get(key, -TOUCH_INTERVAL_SECONDS) < TOUCH_INTERVAL_SECONDS:
+        return
+    _last_touched[key] = now
+    with _connect() as connection:
+        connection.execute(
+            "UPDATE datasets SET last_used = ? WHERE key = ?", (time.time(), key)
+        )
+
+
+def evict(keep: str | None = None) -> list[str]:
+    """
+    Removes expired sessions together with the datasets that are expired or, least
+    recently used first, exceed DATASET_BYTES_LIMIT.
+    :param keep: dataset that is never evicted, e.g. the one just saved
+    :return: keys of the evicted datasets, their files are for the caller to remove
+    """
+    cutoff = time.time() - STATE_TTL_SECONDS
+    with _connect() as connection:
+        connection.execute("DELETE FROM sessions WHERE last_used <= ?", (cutoff,))
+        evicted, total = [], 0
+        for key, size, last_used in connection.execute(
+            "SELECT key, size, last_used FROM datasets ORDER BY last_used DESC"
+        ).fetchall():
+            total += size
+            if key != keep and (last_used <= cutoff or total > DATASET_BYTES_LIMIT):
+                evicted.append(key)
+                total -= size
+        connection.executemany(
+            "DELETE FROM datasets WHERE key = ?", [(key,) for key in evicted]
+        )
+    return evicted
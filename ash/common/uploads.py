@@ -0,0 +1,117 @@
+import os
+import re
+import shutil
+
+from flask import Blueprint, abort, jsonify, request
+from werkzeug.utils import secure_filename
+
+from common.custom_data_utils import UPLOAD_FORMATS
+from common.jobs import job_key, single_flight
+
+UPLOAD_FOLDER = os.path.join(os.getcwd(), "common", "user_data", "uploads")
+# largest chunk accepted by one request, stays below the request size limits
+UPLOAD_CHUNK_BYTES = 8 * 2**20
+# block of a chunk written to disk at once
+STREAM_BLOCK_BYTES = 2**20
+# an upload receiving nothing for this long is reported as stopped
+UPLOAD_STALL_SECONDS = 60
+
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{16,64}$")
+_CONTENT_RANGE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+uploads = Blueprint("uploads", __name__)
+
+
+def upload_path(upload_id: str, filename: str) -> str:
+    """
+    Location of an uploaded file, a file still being uploaded has the .part suffix.
+    :raises ValueError: for malformed upload ids and file names
+    """
+    name = secure_filename(filename)
+    extension = os.path.splitext(name)[1].lower()
+    if not _UPLOAD_ID.match(upload_id) or name != filename:
+        raise ValueError(f"Invalid upload {upload_id}/{filename}")
+    if extension not in UPLOAD_FORMATS:
+        raise ValueError(f"Unsupported file format {filename}")
+    return os.path.join(UPLOAD_FOLDER, upload_id, name)
+
+
+def received_bytes(upload_id: str, filename: str) -> tuple[int, bool]:
+    """
+    :return: tuple (number of bytes received so far, whether the file is complete)
+    """
+    path = upload_path(upload_id, filename)
+    if os.path.exists(path):
+        return os.path.getsize(path), True
+    if os.path.exists(path + ".part"):
+        return os.path.getsize(path + ".part"), False
+    return 0, False
+
+
+def upload_progress(upload_id: str, files: list[dict]) -> tuple[int, int, bool]:
+    """
+    :param files: name and size of every file of the upload
+    :return: tuple (bytes received, bytes expected, whether all files are complete)
+    """
+    received, complete = 0, True
+    for file in files:
+        file_received, file_complete = received_bytes(upload_id, file["name"])
+        received += file_received
+        complete = complete and file_complete
+    return received, sum(file["size"] for file in files), complete
+
+
+def remove_upload(upload_id: str):
+    if _UPLOAD_ID.match(upload_id):
+        shutil.rmtree(os.path.join(UPLOAD_FOLDER, upload_id), ignore_errors=True)
+
+
+def _checked_path(upload_id: str, filename: str) -> str:
+    try:
+        return upload_path(upload_id, filename)
+    except ValueError as error:
+        abort(400, str(error))
+
+
+@uploads.route("/upload/<upload_id>/<filename>", methods=["GET"])
+def upload_status(upload_id: str, filename: str):
+    """
+    Bytes of the file received so far, an interrupted upload resumes from there.
+    """
+    _checked_path(upload_id, filename)
+    received, complete = received_bytes(upload_id, filename)
+    return jsonify(received=received, complete=complete)
+
+
+@uploads.route("/upload/<upload_id>/<filename>", methods=["PUT"])
+def upload_chunk(upload_id: str, filename: str):
+    """
+    Appends a chunk sent with a "Content-Range: bytes start-end/total" header to
+    the file. Chunks have to arrive in order, a chunk not starting at the received
+    size is refused with 409 and the received size.
+    """
+    path = _checked_path(upload_id, filename)
+    match = _CONTENT_RANGE.match(request.headers.get("Content-Range", ""))
+    if not match:
+        abort(400, "Missing Content-Range")
+    start, end, total = (int(group) for group in match.groups())
+    if end < start or end >= total or end - start + 1 > UPLOAD_CHUNK_BYTES:
+        abort(400, "Invalid Content-Range")
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # a retried chunk may arrive while the first attempt is still being written
+    with single_flight(job_key("upload", upload_id, filename)):
+        received, complete = received_bytes(upload_id, filename)
+        if complete or start != received:
+            return jsonify(received=received, complete=complete), 409
+
+        with open(path + ".part", "ab") as file:
+            while block := request.stream.read(STREAM_BLOCK_BYTES):
+                file.write(block)
+            if file.tell() != end + 1:
+                # interrupted or oversized chunk, drop it and let the client resend
+                file.truncate(start)
+                abort(400, "Incomplete chunk")
+        if end + 1 == total:
+            os.replace(path + ".part", path)
+    return jsonify(received=end + 1, complete=end + 1 == total)
@@ -16,7 +16,7 @@ def plot_input_data_reduced(plot_input_data: str, plot_master: PlotMaster, color
         go.Figure: The plotted reduced input data.
     """
     if plot_input_data == "All dimensions":
-        return plot_master.plot_all_dimensions()
+        return plot_master.plot_all_dimensions(color_map)
     elif plot_input_data == "PCA":
         return plot_master.plot_pca(color_map)
     elif "PCA_3D" in plot_input_data:
@@ -134,26 +134,6 @@ def modify_dendrogram_color(dendrogram, xmin, xmax, ymin, ymax, color):
             dendrogram["leaves_color_list"][i] = color
 
 
-def write_to_text_file(filename, content):
-    try:
-        with open(filename, "w") as file:
-            file.write(f"{content}")
-        print(f"Content successfully written to {filename}")
-    except IOError as e:
-        print(f"Error writing to {filename}: {str(e)}")
-
-
-def read_text_file(filename):
-    try:
-        with open(filename, "r") as file:
-            content = file.read()
-        print(f"Content successfully read from {filename}")
-        return eval(content)
-    except IOError as e:
-        print(f"Error reading from {filename}: {str(e)}")
-        return {}
-
-
 def replace_color_values(dendrogram, color_map):
     for i, color in enumerate(dendrogram["color_list"]):
         for old_color, new_color in color_map:
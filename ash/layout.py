@@ -1,6 +1,10 @@
 import dash_bootstrap_components as dbc
 from dash import dash_table, dcc, get_asset_url, html
 
+from common.clustering import (CLUSTERING_MODES, DISTANCE_METRICS,
+                               LINKAGE_METHODS)
+from common.dendrogram_view import HEATMAP_AGGREGATIONS
+
 COMMON_STYLE = {"margin": "40px"}
 COMMON_PADDING = {"padding-bottom": "10px"}
 
@@ -12,8 +16,10 @@ with open("./assets/about.md", "r") as file:
     ABOUT_MD = file.read()
 
 RECALCULATE_MERGE_MATRIX_DIV = html.Div("Data uploaded")
+CLUSTERED_IN_APP_DIV = html.Div("Data uploaded and clustered")
 FAILED_UPLOAD_VALIDATION_DIV = html.Div("Data failed validation")
 LOAD_MERGE_MATRIX_FROM_FILE_DIV = html.Div("Levine et. al.(2015) data loaded")
+SESSION_RESTORED_DIV = html.Div("Data of the previous session loaded")
 
 
 def create_layout(feature_names):
@@ -61,6 +67,62 @@ def create_layout(feature_names):
                                                 id="upload-data",
                                             ),
                                             html.Div(id="output-data-upload"),
+                                            html.Div(id="dataset-expired"),
+                                            dcc.Interval(
+                                                id="dataset-check-interval",
+                                                interval=5000,
+                                            ),
+                                            # large files are sent in chunks to
+                                            # the /upload route, see chunked_upload.js
+                                            html.Button(
+                                                "Upload Large Files",
+                                                id="chunked-upload-button",
+                                                n_clicks=0,
+                                            ),
+                                            html.Div(id="chunked-upload-progress"),
+                                            dcc.Interval(
+                                                id="chunked-upload-interval",
+                                                interval=1000,
+                                                disabled=True,
+                                            ),
+                                            dcc.Store(id="chunked-upload"),
+                                            dcc.Store(id="chunked-upload-complete"),
+                                            # bytes received at the last progress
+                                            dcc.Store(id="chunked-upload-activity"),
+                                            html.H6("Linkage Method:"),
+                                            dcc.Dropdown(
+                                                LINKAGE_METHODS,
+                                                "complete",
+                                                id="linkage-method-dropdown",
+                                                clearable=False,
+                                            ),
+                                            html.H6("Distance Metric:"),
+                                            dcc.Dropdown(
+                                                DISTANCE_METRICS,
+                                                "euclidean",
+                                                id="distance-metric-dropdown",
+                                                clearable=False,
+                                            ),
+                                            html.H6("Clustering Mode:"),
+                                            dcc.Dropdown(
+                                                CLUSTERING_MODES,
+                                                "Exact",
+                                                id="clustering-mode-dropdown",
+                                                clearable=False,
+                                                style=COMMON_PADDING,
+                                            ),
+                                            html.Button(
+                                                "Recalculate Clustering",
+                                                id="recalculate-button",
+                                                n_clicks=0,
+                                            ),
+                                            html.Div(id="recalculate-message"),
+                                            html.Div(id="artifact-readiness"),
+                                            dcc.Interval(
+                                                id="artifact-readiness-interval",
+                                                interval=1000,
+                                                disabled=True,
+                                            ),
                                             html.H6("Colorblind Palette:"),
                                             dcc.Dropdown(
                                                 [
@@ -92,6 +154,17 @@ def create_layout(feature_names):
                                                 id="reset-button",
                                                 n_clicks=0,
                                             ),
+                                            html.Button(
+                                                "Expand Node",
+                                                id="expand-button",
+                                                n_clicks=0,
+                                            ),
+                                            html.Button(
+                                                "Back to Overview",
+                                                id="overview-button",
+                                                n_clicks=0,
+                                            ),
+                                            html.Div(id="expand-message"),
                                             html.Div(
                                                 [
                                                     html.Br(),
@@ -107,6 +180,29 @@ def create_layout(feature_names):
                                                     dcc.Download(id="download-data"),
                                                 ]
                                             ),
+                                            html.Div(
+                                                [
+                                                    html.Br(),
+                                                    html.H6("Session Snapshots:"),
+                                                    html.Button(
+                                                        "Save Snapshot",
+                                                        id="save-snapshot-button",
+                                                        n_clicks=0,
+                                                    ),
+                                                    dcc.Dropdown(
+                                                        [],
+                                                        id="snapshot-dropdown",
+                                                        clearable=False,
+                                                    ),
+                                                    html.Button(
+                                                        "Restore Snapshot",
+                                                        id="restore-snapshot-button",
+                                                        n_clicks=0,
+                                                    ),
+                                                    html.Div(id="snapshot-message"),
+                                                    dcc.Store(id="restored-snapshot"),
+                                                ]
+                                            ),
                                         ],
                                         style={
                                             "float": "left",
@@ -122,6 +218,13 @@ def create_layout(feature_names):
                                                     dcc.Graph(
                                                         id="dendrogram-custom",
                                                     ),
+                                                    html.H6("Heatmap Bins:"),
+                                                    dcc.Dropdown(
+                                                        list(HEATMAP_AGGREGATIONS),
+                                                        "Mean",
+                                                        id="heatmap-aggregation-dropdown",
+                                                        clearable=False,
+                                                    ),
                                                     html.H1("Cluster-specific Heatmap"),
                                                     dcc.Dropdown(
                                                         list(feature_names),
@@ -189,14 +292,30 @@ def create_layout(feature_names):
                                                         id="plot_dropdown",
                                                         value=None,
                                                     ),
+                                                    html.Div(id="progress-dim-red"),
+                                                    html.Button(
+                                                        "Cancel",
+                                                        id="cancel-dim-red-button",
+                                                        n_clicks=0,
+                                                        style={"display": "none"},
+                                                    ),
                                                     dcc.Graph(
                                                         id="reduced-graph",
                                                     ),
+                                                    # set when a reduction is drawn
+                                                    dcc.Store(id="reduced-graph-drawn"),
                                                     html.Div(
                                                         id="error-message-dim-custom"
                                                     ),
                                                     dcc.Store(id="merge-matrix-memory"),
+                                                    dcc.Store(
+                                                        id="session-id",
+                                                        # one session per tab
+                                                        storage_type="session",
+                                                    ),
                                                     dcc.Store(id="dendrogram-memory"),
+                                                    # x range of the shown dendrogram
+                                                    dcc.Store(id="dendrogram-x-range"),
                                                     dcc.Store(
                                                         id="dendrogram-click-memory"
                                                     ),
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# the app finds its assets and user data relative to the working directory
+ASH_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+os.chdir(ASH_FOLDER)
+if ASH_FOLDER not in sys.path:
+    sys.path.insert(0, ASH_FOLDER)
@@ -0,0 +1,197 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import plotly.io
+import pytest
+from scipy.cluster.hierarchy import linkage
+
+from common import cluster_state, linkage_index
+from common.cluster_state import ClusterState, cluster_state_for
+from common.custom_threshold_plotly_dendrogram import create_dendrogram_modified
+from common.dataset_store import StoredDataset
+
+NR_THREADS = 8
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    cluster_state._STATE_CACHE.clear()
+    linkage_index._INDEX_CACHE.clear()
+    yield
+    cluster_state._STATE_CACHE.clear()
+    linkage_index._INDEX_CACHE.clear()
+
+
+def _linkage(nr_points=300, seed=0):
+    return linkage(np.random.default_rng(seed).random((nr_points, 3)), "complete")
+
+
+class _ShownDendrogram:
+    """
+    What a browser shows: built in full once, afterwards only patched with the
+    changes cluster_state_for returns.
+    """
+
+    def __init__(self, index, split_points, cluster_ids):
+        self.index = index
+        self.previous = None
+        self.show(split_points, cluster_ids)
+
+    def show(self, split_points, cluster_ids):
+        state, change = cluster_state_for(
+            self.index, split_points, cluster_ids, self.previous
+        )
+        if change is None:
+            self.cluster_indices = state.cluster_indices.copy()
+            self.link_clusters = state.link_clusters.copy()
+        else:
+            self.cluster_indices[change.points] = state.cluster_indices[change.points]
+            self.link_clusters[change.rows] = state.link_clusters[change.rows]
+        self.previous = list(split_points), list(cluster_ids)
+        return change
+
+    def assert_matches_rebuild(self):
+        rebuilt = ClusterState(self.index, *self.previous)
+        np.testing.assert_array_equal(self.cluster_indices, rebuilt.cluster_indices)
+        np.testing.assert_array_equal(self.link_clusters, rebuilt.link_clusters)
+
+
+def test_split_unsplit_resplit_patches_the_shown_dendrogram():
+    index = linkage_index.get_linkage_index(_linkage())
+    shown = _ShownDendrogram(index, [], [])
+    for split_points, cluster_ids in [([3], [1]), ([], []), ([3], [1])]:
+        change = shown.show(split_points, cluster_ids)
+        assert change is not None and len(change.points) > 0
+        shown.assert_matches_rebuild()
+
+
+def test_sessions_sharing_the_cache_get_their_own_changes():
+    index = linkage_index.get_linkage_index(_linkage())
+    first, second = _ShownDendrogram(index, [], []), _ShownDendrogram(index, [], [])
+    steps = [([3], [1]), ([3, 5], [1, 2]), ([5], [2]), ([5], [2]), ([], [])]
+    for split_points, cluster_ids in steps:
+        # the second session repeats what the first one just cached
+        for shown in (first, second):
+            shown.show(split_points, cluster_ids)
+            shown.assert_matches_rebuild()
+
+
+def test_artifacts_and_states_are_built_once_from_many_threads(monkeypatch):
+    builds = {"index": 0, "coordinates": 0, "artifact": 0}
+    count_lock = threading.Lock()
+
+    def counted(name):
+        with count_lock:
+            builds[name] += 1
+        # widens the window in which other threads could start a second build
+        time.sleep(0.05)
+
+    class CountedIndex(linkage_index.LinkageIndex):
+        def __init__(self, matrix):
+            counted("index")
+            super().__init__(matrix)
+
+        def _build_link_coordinates(self):
+            counted("coordinates")
+            return super()._build_link_coordinates()
+
+    def build_artifact():
+        counted("artifact")
+        return object()
+
+    monkeypatch.setattr(linkage_index, "LinkageIndex", CountedIndex)
+    matrix = _linkage()
+    nr_points = len(matrix) + 1
+    stored = StoredDataset(
+        "test",
+        pd.DataFrame(np.random.default_rng(1).random((nr_points, 2))),
+        matrix,
+        range(nr_points),
+        range(nr_points),
+    )
+    steps = [([3], [1]), ([3, 5], [1, 2]), ([5], [2]), ([], []), ([7], [3])]
+    barrier = threading.Barrier(NR_THREADS)
+
+    def work(seed):
+        barrier.wait()
+        index = stored.linkage_index
+        coordinates = index.link_coordinates()
+        artifact = stored.artifact("counted", build_artifact)
+        shown = _ShownDendrogram(index, [], [])
+        # every thread walks the steps in its own order
+        states = {}
+        for split_points, cluster_ids in random.Random(seed).sample(steps, len(steps)):
+            shown.show(split_points, cluster_ids)
+            shown.assert_matches_rebuild()
+            states[tuple(split_points)] = shown.cluster_indices.copy()
+        return index, coordinates, artifact, states
+
+    with ThreadPoolExecutor(NR_THREADS) as executor:
+        results = list(executor.map(work, range(NR_THREADS)))
+
+    assert builds == {"index": 1, "coordinates": 1, "artifact": 1}
+    index, coordinates, artifact, states = results[0]
+    for other_index, other_coordinates, other_artifact, other_states in results[1:]:
+        assert other_index is index
+        assert other_coordinates is coordinates
+        assert other_artifact is artifact
+        assert other_states.keys() == states.keys()
+        for split_points, cluster_indices in states.items():
+            np.testing.assert_array_equal(other_states[split_points], cluster_indices)
+
+
+def _built(matrix, split_points, cluster_ids, colorblind_palette):
+    dendrogram = create_dendrogram_modified(
+        matrix,
+        labels=list(range(len(matrix) + 1)),
+        colorblind_palette=colorblind_palette,
+        monocrit_list=split_points,
+        cluster_ids=cluster_ids,
+    )
+    # everything create_dendrogram stores and plots, in a comparable form
+    return plotly.io.to_json(
+        {
+            "data": dendrogram.data,
+            "layout": dendrogram.layout,
+            "labels": dendrogram.labels,
+            "leaves": dendrogram.leaves,
+            "leaves_color_map_translated": dendrogram.leaves_color_map_translated,
+            "clusters": dendrogram.clusters,
+            "cluster_indices": dendrogram.cluster_indices,
+            "color_map": dendrogram.color_map,
+        }
+    )
+
+
+def test_parallel_dendrogram_builds_equal_serial_builds():
+    matrix = _linkage()
+    builds = [
+        (split_points, cluster_ids, colorblind_palette)
+        for split_points, cluster_ids in [
+            ([], []),
+            ([3], [1]),
+            ([3, 5], [1, 2]),
+            ([5, 3], [2, 1]),
+            ([2, 9, 4], [4, 5, 6]),
+        ]
+        for colorblind_palette in (False, True)
+    ]
+    serial = [_built(matrix, *build) for build in builds]
+
+    cluster_state._STATE_CACHE.clear()
+    linkage_index._INDEX_CACHE.clear()
+    barrier = threading.Barrier(NR_THREADS)
+
+    def work(seed):
+        barrier.wait()
+        # every thread builds all dendrograms in its own order
+        order = random.Random(seed).sample(range(len(builds)), len(builds))
+        return {position: _built(matrix, *builds[position]) for position in order}
+
+    with ThreadPoolExecutor(NR_THREADS) as executor:
+        for parallel in executor.map(work, range(NR_THREADS)):
+            assert [parallel[position] for position in range(len(builds))] == serial
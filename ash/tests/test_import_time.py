@@ -0,0 +1,39 @@
+import json
+import os
+import subprocess
+import sys
+
+ASH_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# generous for slow CI machines, importing scikit-learn and umap alone takes longer
+IMPORT_SECONDS_BUDGET = 5.0
+
+IMPORT_APP = """
+import json, sys, time
+start = time.perf_counter()
+import app
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "modules": sorted(name for name in ("sklearn", "umap") if name in sys.modules),
+}))
+"""
+
+
+def _import_app():
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_APP],
+        cwd=ASH_FOLDER,
+        capture_output=True,
+        text=True,
+        check=True,
+        timeout=120,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_app_imports_within_budget():
+    assert _import_app()["seconds"] < IMPORT_SECONDS_BUDGET
+
+
+def test_app_import_skips_heavy_libraries():
+    assert _import_app()["modules"] == []
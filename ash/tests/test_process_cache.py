@@ -0,0 +1,57 @@
+import os
+import threading
+
+from common.process_cache import ForkSafeLock, LRUCache
+
+
+def test_lru_cache_evicts_the_least_recently_used_value():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.values() == [1, 3]
+
+
+def test_lru_cache_builds_a_value_once():
+    cache = LRUCache(2)
+    builds = []
+    barrier = threading.Barrier(4)
+
+    def build():
+        builds.append(1)
+        return object()
+
+    def work():
+        barrier.wait()
+        return cache.get_or_build("key", build)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(builds) == 1
+
+
+def test_lock_held_by_a_thread_is_released_in_a_forked_child():
+    lock = ForkSafeLock()
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        with lock:
+            held.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait()
+    pid = os.fork()
+    if pid == 0:
+        # the holding thread does not exist in the child
+        os._exit(0 if lock.acquire(timeout=5) else 1)
+    release.set()
+    thread.join()
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0